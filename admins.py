@@ -0,0 +1,65 @@
+from aiogram import Bot
+from singleflight import SingleFlight
+import fanout
+import asyncio
+import logging
+import os
+
+# Fallback refresh, in case a promotion or demotion update was missed
+ADMIN_REFRESH_INTERVAL_RAW = os.environ.get("ADMIN_REFRESH_INTERVAL_SECONDS", "900").strip()
+try:
+    ADMIN_REFRESH_INTERVAL: float = float(ADMIN_REFRESH_INTERVAL_RAW)
+except Exception:
+    logging.error("ADMIN_REFRESH_INTERVAL_SECONDS must be a number of seconds (e.g., 900)")
+    ADMIN_REFRESH_INTERVAL = 900.0
+
+
+# Administrators of every connected chat, loaded with get_chat_administrators
+class AdminRoster:
+    def __init__(self):
+        self._admins: dict[int, frozenset[int]] = {}
+        # A refresh and a reload of the chat list may ask for the same chat at once
+        self._flights = SingleFlight()
+
+    # None when the chat's roster is unknown and the caller has to ask Telegram
+    def is_admin(self, chat_id: int, user_id: int) -> bool | None:
+        admins = self._admins.get(chat_id)
+        if admins is None:
+            return None
+        return user_id in admins
+
+    def apply_status(self, chat_id: int, user_id: int, status: str) -> None:
+        admins = self._admins.get(chat_id)
+        if admins is None:
+            return
+        if status in ["administrator", "creator"]:
+            self._admins[chat_id] = admins | {user_id}
+        elif user_id in admins:
+            self._admins[chat_id] = admins - {user_id}
+
+    async def load(self, bot: Bot, chat_id: int) -> bool:
+        return await self._flights.do(chat_id, lambda: self._load(bot, chat_id))
+
+    async def _load(self, bot: Bot, chat_id: int) -> bool:
+        try:
+            members = await bot.get_chat_administrators(chat_id=chat_id)
+        except Exception as err:
+            logging.error("Could not load administrators of chat %s: %s", chat_id, err)
+            return False
+        self._admins[chat_id] = frozenset(member.user.id for member in members)
+        return True
+
+    async def load_all(self, bot: Bot, chat_ids: list[int]) -> None:
+        results = await fanout.gather_limited(chat_ids, lambda chat_id: self.load(bot, chat_id))
+        logging.info("Loaded administrators of %s/%s chat(s)", sum(results), len(chat_ids))
+
+    async def refresh_forever(self, bot: Bot, get_chat_ids, interval: float = ADMIN_REFRESH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.load_all(bot, get_chat_ids())
+
+    def stats(self) -> dict:
+        return {"chats": len(self._admins), **self._flights.stats()}
+
+
+roster = AdminRoster()
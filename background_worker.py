@@ -1,19 +1,49 @@
-from flask import Flask
-from flask import request
-from threading import Thread
-import time
-import requests
+from aiohttp import web
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
+readiness_key = web.AppKey("readiness", object)
 
-app = Flask('')
 
-@app.route('/')
-def home():
-  return "I'm alive"
+async def home(request: web.Request) -> web.Response:
+  return web.Response(text="I'm alive")
 
-def run():
-  app.run(host='0.0.0.0', port=80)
 
-def keep_alive():
-  t = Thread(target=run)
-  t.start()
\ No newline at end of file
+# Liveness: the process and its event loop answer, nothing else is checked
+async def healthz(request: web.Request) -> web.Response:
+  return web.json_response({"status": "ok"})
+
+
+# Readiness: only a fully started bot that reaches Telegram and the database gets traffic
+async def readyz(request: web.Request) -> web.Response:
+  check = request.app.get(readiness_key)
+  if check is None:
+    return web.json_response({"status": "ok"})
+  ready, details = await check()
+  return web.json_response(
+    {"status": "ok" if ready else "unavailable", **details},
+    status=200 if ready else 503
+  )
+
+
+async def prometheus_metrics(request: web.Request) -> web.Response:
+  return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+# readiness: async callable returning (ready, details)
+def build_app(readiness=None) -> web.Application:
+  app = web.Application()
+  app[readiness_key] = readiness
+  app.router.add_get('/', home)
+  app.router.add_get('/healthz', healthz)
+  app.router.add_get('/readyz', readyz)
+  app.router.add_get('/metrics', prometheus_metrics)
+  return app
+
+
+# Served from the bot's own event loop: no second thread, no separate WSGI server
+async def start_web_server(app: web.Application, port: int) -> web.AppRunner:
+  runner = web.AppRunner(app)
+  await runner.setup()
+  site = web.TCPSite(runner, host='0.0.0.0', port=port)
+  await site.start()
+  return runner
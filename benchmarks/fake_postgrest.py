@@ -0,0 +1,114 @@
+from aiohttp import web
+from collections import Counter
+import asyncio
+import datetime
+import itertools
+import json
+
+# In-process stand-in for the PostgREST `users` endpoint behind Supabase. It covers the subset
+# of the query language database.py uses: eq, in, gt, order, limit/offset, select, upsert with
+# on_conflict and count=exact
+
+
+def _parse_value(raw: str):
+    raw = raw.strip().strip('"')
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+class FakePostgrest:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.rows: list[dict] = []
+        self.requests = Counter()
+        self._ids = itertools.count(1)
+
+    def insert(self, **row) -> dict:
+        row.setdefault("id", next(self._ids))
+        row.setdefault("joined_at", datetime.datetime.now(datetime.timezone.utc).isoformat())
+        self.rows.append(row)
+        return row
+
+    @staticmethod
+    def _matches(row: dict, query) -> bool:
+        for column, condition in query.items():
+            if column in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            operator, _, raw = condition.partition(".")
+            cell = row.get(column)
+            if operator == "eq":
+                if str(cell) != raw:
+                    return False
+            elif operator == "in":
+                if cell not in [_parse_value(part) for part in raw.strip("()").split(",")]:
+                    return False
+            elif operator == "gt":
+                if cell is None or not cell > _parse_value(raw):
+                    return False
+            else:
+                raise web.HTTPBadRequest(text=json.dumps({"message": f"unsupported operator {operator}"}))
+        return True
+
+    @staticmethod
+    def _project(rows: list[dict], select: str) -> list[dict]:
+        if select == "*":
+            return rows
+        columns = select.split(",")
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def _count_headers(self, request: web.Request, count: int) -> dict:
+        if "count=exact" in request.headers.get("Prefer", ""):
+            return {"Content-Range": f"*/{count}"}
+        return {}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests[request.method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = request.query
+        prefer = request.headers.get("Prefer", "")
+        matched = [row for row in self.rows if self._matches(row, query)]
+
+        if request.method == "GET":
+            for part in reversed(query.get("order", "").split(",")):
+                if part:
+                    column, _, direction = part.partition(".")
+                    matched.sort(key=lambda row: row.get(column), reverse=direction.startswith("desc"))
+            total = len(matched)
+            offset = int(query.get("offset", 0))
+            limit = query.get("limit")
+            matched = matched[offset:offset + int(limit) if limit is not None else None]
+            return web.json_response(
+                self._project(matched, query.get("select", "*")),
+                headers=self._count_headers(request, total)
+            )
+
+        if request.method == "DELETE":
+            removed = {id(row) for row in matched}
+            self.rows = [row for row in self.rows if id(row) not in removed]
+            if "return=minimal" in prefer:
+                return web.Response(status=204, headers=self._count_headers(request, len(matched)))
+            return web.json_response(matched, headers=self._count_headers(request, len(matched)))
+
+        if request.method == "POST":
+            payload = await request.json()
+            keys = query.get("on_conflict", "").split(",") if "on_conflict" in query else []
+            created = []
+            for data in payload if isinstance(payload, list) else [payload]:
+                if keys and any(all(row.get(key) == data.get(key) for key in keys) for row in self.rows):
+                    continue
+                if data.get("joined_at") == "now()":
+                    data.pop("joined_at")
+                created.append(self.insert(**data))
+            if "return=minimal" in prefer:
+                return web.Response(status=201)
+            return web.json_response(self._project(created, query.get("select", "*")), status=201)
+
+        raise web.HTTPMethodNotAllowed(request.method, ["GET", "POST", "DELETE"])
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/rest/v1/users", self.handle)
+        return app
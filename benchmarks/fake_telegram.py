@@ -0,0 +1,99 @@
+from aiohttp import web
+from collections import Counter
+import asyncio
+import itertools
+import json
+import time
+
+# In-process stand-in for the Bot API: answers every method the bot calls with a minimal valid
+# result, after an injected delay, and counts the calls. Membership is kept in `members`
+
+
+class FakeTelegram:
+    def __init__(self, bot_id: int, latency: float = 0.0):
+        self.bot_id = bot_id
+        self.latency = latency
+        self.members: dict[tuple[int, int], str] = {}
+        self.admins: dict[int, list[int]] = {}
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int, is_bot: bool = False) -> dict:
+        return {"id": user_id, "is_bot": is_bot, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    # Statuses used by the scenarios: member, left, kicked and creator
+    def _member(self, chat_id: int, user_id: int) -> dict:
+        status = self.members.get((chat_id, user_id), "left")
+        member = {"status": status, "user": self._user(user_id)}
+        if status == "creator":
+            member["is_anonymous"] = False
+        elif status == "kicked":
+            member["until_date"] = 0
+        return member
+
+    def _message(self, chat_id: int, text: str | None) -> dict:
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "text": text or "",
+        }
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            return {**self._user(self.bot_id, is_bot=True), "first_name": "Benchmark bot"}
+        if method == "getChatMember":
+            return self._member(chat_id, int(params["user_id"]))
+        if method == "getChatAdministrators":
+            return [
+                {"status": "creator", "user": self._user(user_id), "is_anonymous": False}
+                for user_id in self.admins.get(chat_id, [])
+            ]
+        if method == "getChat":
+            return {
+                "id": chat_id,
+                "type": "supergroup",
+                "title": f"Chat {chat_id}",
+                "accent_color_id": 0,
+                "max_reaction_count": 11,
+                "accepted_gift_types": {
+                    "unlimited_gifts": False,
+                    "limited_gifts": False,
+                    "unique_gifts": False,
+                    "premium_subscription": False,
+                },
+            }
+        if method == "createChatInviteLink":
+            return {
+                "invite_link": f"https://t.me/+bench{next(self._ids)}",
+                "creator": self._user(self.bot_id, is_bot=True),
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "member_limit": int(params.get("member_limit", 1)),
+            }
+        if method in ["sendMessage", "editMessageText", "sendDocument"]:
+            return self._message(chat_id, params.get("text") or params.get("caption"))
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = dict(await request.post())
+        for value in params.values():
+            # Files arrive as uploads and are only drained
+            if isinstance(value, web.FileField):
+                value.file.read()
+        return web.Response(
+            text=json.dumps({"ok": True, "result": self._result(method, params)}),
+            content_type="application/json"
+        )
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
@@ -0,0 +1,248 @@
+from aiohttp import web
+from benchmarks.fake_postgrest import FakePostgrest
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks import scenarios
+from collections import Counter, defaultdict
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+# Offline load test: the real Dispatcher and handlers against local Bot API and PostgREST stand-ins.
+#   python -m benchmarks.run
+#   python -m benchmarks.run --scenario join_burst --count 500 --telegram-latency-ms 80
+#   python -m benchmarks.run --json report.json --max-p99-ms 250   # exits 1 above the budget
+# Run from the repository root; nothing leaves the machine
+
+BOT_ID = 123456
+SEND_QUEUE_DRAIN_TIMEOUT = 60.0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay generated update streams against local stand-ins")
+    parser.add_argument("--scenario", action="append", choices=sorted(scenarios.SCENARIOS),
+                        help="scenario to run, repeatable (default: all)")
+    parser.add_argument("--count", type=int, default=200, help="sessions per scenario (default: 200)")
+    parser.add_argument("--concurrency", type=int, default=100, help="sessions fed at once (default: 100)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=40, help="Bot API delay (default: 40)")
+    parser.add_argument("--db-latency-ms", type=float, default=30, help="PostgREST delay (default: 30)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep the real send rate limits; by default they are lifted, so the report "
+                             "shows the bot's own cost rather than Telegram's pacing")
+    parser.add_argument("--throttle", action="store_true",
+                        help="keep the per-user and per-chat update limits; by default they are lifted, "
+                             "since flat_spam sends every command from one admin")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, help="fail when any handler's p99 exceeds this")
+    return parser.parse_args()
+
+
+async def start_site(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def configure_env(args: argparse.Namespace, telegram_url: str, postgrest_url: str) -> None:
+    # Read by the bot modules at import, so this has to happen before `import bot`
+    os.environ.update({
+        "TELEGRAM_KEY": f"{BOT_ID}:BENCHMARK",
+        "TELEGRAM_API_URL": telegram_url,
+        "SUPABASE_URL": postgrest_url,
+        "SUPABASE_KEY": "benchmark.benchmark.benchmark",
+        "GROUP_CHAT_IDS": json.dumps(scenarios.BUILDING_CHATS),
+        "COUNCIL_CHAT_IDS": json.dumps(scenarios.COUNCIL_CHATS),
+        "PUBLIC_CHAT_ID": str(scenarios.PUBLIC_CHAT_ID),
+        "BUILDINGS": ",".join(scenarios.BUILDINGS),
+        "OWNER_IDS": "",
+        "CONFIG_FILE": "",
+        "FSM_STORAGE": "memory",
+        "LOOP_DIAGNOSTICS": "",
+        "RECONCILE_INTERVAL_HOURS": "0",
+        "OUTBOX_PATH": ":memory:",
+    })
+    if not args.telegram_limits:
+        os.environ.update({
+            "SEND_GLOBAL_PER_SECOND": "100000",
+            "SEND_GROUP_PER_MINUTE": "6000000",
+            "SEND_PRIVATE_PER_SECOND": "100000",
+        })
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class HandlerTimer:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[data["handler"].callback.__name__].append(time.perf_counter() - started_at)
+
+
+async def drain_send_queue(sender) -> float:
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < SEND_QUEUE_DRAIN_TIMEOUT:
+        stats = sender.scheduler.stats()
+        if not stats["queued"] and not stats["in_flight"]:
+            break
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - started_at
+
+
+async def run_scenario(name, bot_module, sender, telegram, postgrest, timer, args, first_id) -> dict:
+    sessions = scenarios.SCENARIOS[name](telegram, postgrest, args.count, first_id)
+    updates = sum(len(session) for session in sessions)
+    calls_before = Counter(telegram.calls)
+    queries_before = sum(postgrest.requests.values())
+    timer.samples.clear()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def replay(session):
+        async with slots:
+            for update in session:
+                await bot_module.dp.feed_update(bot_module.bot, update)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(replay(session) for session in sessions))
+    elapsed = time.perf_counter() - started_at
+    drained = await drain_send_queue(sender)
+
+    calls = Counter(telegram.calls)
+    calls.subtract(calls_before)
+    api_calls = {method: count for method, count in sorted(calls.items()) if count}
+    return {
+        "scenario": name,
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "send_queue_drain_seconds": round(drained, 3),
+        "updates_per_second": round(updates / elapsed, 1) if elapsed else None,
+        "api_calls_per_update": round(sum(api_calls.values()) / updates, 2),
+        "db_queries_per_update": round((sum(postgrest.requests.values()) - queries_before) / updates, 2),
+        "api_calls": api_calls,
+        "handlers": {
+            handler: {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 1),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 1),
+                "max_ms": round(max(samples) * 1000, 1),
+            }
+            for handler, samples in sorted(timer.samples.items())
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    settings = report["settings"]
+    print(
+        f"count={settings['count']} concurrency={settings['concurrency']} "
+        f"telegram latency={settings['telegram_latency_ms']} ms db latency={settings['db_latency_ms']} ms "
+        f"send limits={'on' if settings['telegram_limits'] else 'off'}"
+    )
+    for result in report["scenarios"]:
+        print()
+        print(
+            f"{result['scenario']}: {result['updates']} updates in {result['seconds']} s "
+            f"({result['updates_per_second']}/s), send queue drained in {result['send_queue_drain_seconds']} s"
+        )
+        print(
+            f"  per update: {result['api_calls_per_update']} API calls, {result['db_queries_per_update']} DB queries"
+        )
+        print(f"  API calls: {', '.join(f'{method} {count}' for method, count in result['api_calls'].items())}")
+        print(f"  {'handler':<28}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for handler, timing in result["handlers"].items():
+            print(f"  {handler:<28}{timing['count']:>7}{timing['p50_ms']:>10}{timing['p99_ms']:>10}{timing['max_ms']:>10}")
+
+
+async def main() -> int:
+    args = parse_args()
+    telegram = FakeTelegram(BOT_ID, args.telegram_latency_ms / 1000)
+    postgrest = FakePostgrest(args.db_latency_ms / 1000)
+    telegram_runner, telegram_url = await start_site(telegram.build_app())
+    postgrest_runner, postgrest_url = await start_site(postgrest.build_app())
+    configure_env(args, telegram_url, postgrest_url)
+
+    import bot as bot_module
+    import admins
+    import database
+    import invites
+    import sender
+    import throttle
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.throttle:
+        throttle.limiter.limits = {}
+
+    for chat_id in [*scenarios.BUILDING_CHATS.values(), scenarios.PUBLIC_CHAT_ID]:
+        telegram.admins[chat_id] = [scenarios.ADMIN_ID]
+    timer = HandlerTimer()
+    for event_name, observer in bot_module.dp.observers.items():
+        # The update observer only routes to the others and would time every update twice
+        if event_name not in ["error", "update"]:
+            observer.middleware(timer)
+
+    bot_module.create_bot()
+    database.client()
+    sender.scheduler.start(bot_module.bot)
+    await admins.roster.load_all(bot_module.bot, bot_module.all_connected_chat_ids())
+    # The pool is filled up front, as it would be on a bot that has been running for a while
+    invites.INVITE_POOL_CREATE_INTERVAL = 0
+    for chat_id in bot_module.all_connected_chat_ids():
+        await invites.pool.refill(bot_module.bot, chat_id, invites.pool.high)
+    invite_refill = asyncio.create_task(invites.pool.refill_forever(bot_module.bot, bot_module.all_connected_chat_ids))
+
+    report = {
+        "settings": {
+            "count": args.count,
+            "concurrency": args.concurrency,
+            "telegram_latency_ms": args.telegram_latency_ms,
+            "db_latency_ms": args.db_latency_ms,
+            "telegram_limits": args.telegram_limits,
+        },
+        "scenarios": [],
+    }
+    try:
+        for index, name in enumerate(args.scenario or list(scenarios.SCENARIOS)):
+            # Separate id ranges, so one scenario's caches never answer for the next
+            first_id = 1_000_000 * (index + 1)
+            report["scenarios"].append(
+                await run_scenario(name, bot_module, sender, telegram, postgrest, timer, args, first_id)
+            )
+    finally:
+        invite_refill.cancel()
+        await sender.scheduler.stop()
+        await bot_module.bot.session.close()
+        await telegram_runner.cleanup()
+        await postgrest_runner.cleanup()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, ensure_ascii=False, indent=2)
+
+    if args.max_p99_ms is not None:
+        slow = [
+            f"{result['scenario']}/{handler} p99 {timing['p99_ms']} ms"
+            for result in report["scenarios"]
+            for handler, timing in result["handlers"].items()
+            if timing["p99_ms"] > args.max_p99_ms
+        ]
+        if slow:
+            print(f"\nOver the {args.max_p99_ms} ms p99 budget: {'; '.join(slow)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,115 @@
+from aiogram.types import CallbackQuery, Chat, ChatJoinRequest, ChatMemberLeft, ChatMemberMember, ChatMemberUpdated, Message, Update, User
+import datetime
+import itertools
+
+# Update streams replayed by benchmarks.run. Every scenario seeds the stand-ins and returns a list
+# of sessions; the updates of one session are fed one after another, like a user waiting for each
+# answer, while different sessions run side by side
+
+BUILDING_CHATS = {"2": -1001, "2к1": -1002}
+BUILDINGS = ["2", "2к1", "2к4"]
+PUBLIC_CHAT_ID = -1009
+COUNCIL_CHATS = {"2": -1101}
+ADMIN_ID = 2
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user{user_id}")
+
+
+def _chat(chat_id: int) -> Chat:
+    return Chat(id=chat_id, type="private" if chat_id > 0 else "supergroup", title=None if chat_id > 0 else f"Chat {chat_id}")
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def message(chat_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=next(_update_ids),
+        message=Message(message_id=next(_message_ids), date=_now(), chat=_chat(chat_id), from_user=_user(user_id), text=text)
+    )
+
+
+def callback(user_id: int, data: str, chat_id: int | None = None) -> Update:
+    chat_id = chat_id or user_id
+    return Update(
+        update_id=next(_update_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_message_ids)),
+            from_user=_user(user_id),
+            chat_instance="benchmark",
+            message=Message(message_id=next(_message_ids), date=_now(), chat=_chat(chat_id), text="…"),
+            data=data
+        )
+    )
+
+
+def join_request(chat_id: int, user_id: int) -> Update:
+    return Update(
+        update_id=next(_update_ids),
+        chat_join_request=ChatJoinRequest(chat=_chat(chat_id), from_user=_user(user_id), user_chat_id=user_id, date=_now())
+    )
+
+
+def left_chat(chat_id: int, user_id: int) -> Update:
+    return Update(
+        update_id=next(_update_ids),
+        chat_member=ChatMemberUpdated(
+            chat=_chat(chat_id),
+            from_user=_user(user_id),
+            date=_now(),
+            old_chat_member=ChatMemberMember(user=_user(user_id)),
+            new_chat_member=ChatMemberLeft(user=_user(user_id))
+        )
+    )
+
+
+# New residents going through /start → consent → building → flat number
+def registration(telegram, postgrest, count: int, first_id: int) -> list[list[Update]]:
+    sessions = []
+    for user_id in range(first_id, first_id + count):
+        building = BUILDINGS[user_id % len(BUILDINGS)]
+        sessions.append([
+            message(user_id, user_id, "/start"),
+            callback(user_id, "start_join_chat"),
+            message(user_id, user_id, "✅ Согласен"),
+            callback(user_id, f"building_{building}"),
+            message(user_id, user_id, str(user_id % 400 + 1)),
+        ])
+    return sessions
+
+
+# Everybody asks to join one building chat at once; half of them are registered residents
+def join_burst(telegram, postgrest, count: int, first_id: int) -> list[list[Update]]:
+    for user_id in range(first_id, first_id + count, 2):
+        postgrest.insert(telegram_id=user_id, building="2", flat_number=str(user_id % 400 + 1))
+    return [[join_request(BUILDING_CHATS["2"], user_id)] for user_id in range(first_id, first_id + count)]
+
+
+# Registered residents leave their building chat; half of them stay in the shared chat
+def mass_leave(telegram, postgrest, count: int, first_id: int) -> list[list[Update]]:
+    for user_id in range(first_id, first_id + count):
+        postgrest.insert(telegram_id=user_id, building="2", flat_number=str(user_id % 400 + 1))
+        if user_id % 2:
+            telegram.members[(PUBLIC_CHAT_ID, user_id)] = "member"
+    return [[left_chat(BUILDING_CHATS["2"], user_id)] for user_id in range(first_id, first_id + count)]
+
+
+# An administrator hammers /flat in the shared chat, where the search covers every building
+def flat_spam(telegram, postgrest, count: int, first_id: int) -> list[list[Update]]:
+    for offset in range(30):
+        postgrest.insert(telegram_id=first_id + offset, building=BUILDINGS[offset % len(BUILDINGS)], flat_number="12")
+    return [[message(PUBLIC_CHAT_ID, ADMIN_ID, "/flat 12")] for _ in range(count)]
+
+
+SCENARIOS = {
+    "registration": registration,
+    "join_burst": join_burst,
+    "mass_leave": mass_leave,
+    "flat_spam": flat_spam,
+}
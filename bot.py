@@ -1,81 +1,51 @@
-from background_worker import keep_alive
-keep_alive()
-from supabase import create_client, Client
+from background_worker import build_app, start_web_server
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ChatMemberUpdated, ChatJoinRequest
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ChatMemberUpdated, ChatJoinRequest, InlineKeyboardMarkup, FSInputFile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import CommandStart, Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.exceptions import TelegramMigrateToChat
+from aiogram.methods import ApproveChatJoinRequest, SendDocument, SendMessage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 import asyncio
+import csv
+import datetime
 import logging
 import os
-import json
+import signal
+import tempfile
+import time
 from dotenv import load_dotenv
 load_dotenv()
-
-# Supabase
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Before the other modules: their configuration errors are logged while they are imported
+import logs
+logs.configure()
+import admins
+import database
+import diagnostics
+import digest
+import fanout
+import fsm_storage
+import invites
+import join_batcher
+import membership
+import metrics
+import outbox
+import reconciler
+import registration_stats
+import registry
+import replica
+import sender
+import throttle
 
 # Telegram
 TELEGRAM_KEY = os.environ.get("TELEGRAM_KEY")
-# Example formats for GROUP_CHAT_IDS env:
-# JSON: {"2": -1001234567890, "2к1": -1002345678901}
-# Python dict: {'2': -1001234567890, '2к1': -1002345678901}
-GROUP_CHAT_IDS_RAW = os.environ.get("GROUP_CHAT_IDS", "{}")
-try:
-    parsed_mapping = json.loads(GROUP_CHAT_IDS_RAW)
-except Exception:
-    try:
-        import ast
-        parsed_mapping = ast.literal_eval(GROUP_CHAT_IDS_RAW)
-    except Exception:
-        logging.error("Failed to parse GROUP_CHAT_IDS env variable. Provide JSON or Python dict mapping of building->chat_id")
-        parsed_mapping = {}
-
-try:
-    GROUP_CHAT_IDS: dict[str, int] = {str(k): int(v) for k, v in dict(parsed_mapping).items()}
-except Exception:
-    logging.error("GROUP_CHAT_IDS contains non-numeric chat ids; please use integers (e.g., -1001234567890)")
-    GROUP_CHAT_IDS = {}
-
-# Building council chats: receive detailed join notifications. Same format as GROUP_CHAT_IDS
-COUNCIL_CHAT_IDS_RAW = os.environ.get("COUNCIL_CHAT_IDS", "{}")
-try:
-    council_parsed_mapping = json.loads(COUNCIL_CHAT_IDS_RAW)
-except Exception:
-    try:
-        import ast
-        council_parsed_mapping = ast.literal_eval(COUNCIL_CHAT_IDS_RAW)
-    except Exception:
-        logging.error("Failed to parse COUNCIL_CHAT_IDS env variable. Provide JSON or Python dict mapping of building->chat_id")
-        council_parsed_mapping = {}
-
-try:
-    COUNCIL_CHAT_IDS: dict[str, int] = {str(k): int(v) for k, v in dict(council_parsed_mapping).items()}
-except Exception:
-    logging.error("COUNCIL_CHAT_IDS contains non-numeric chat ids; please use integers (e.g., -1001234567890)")
-    COUNCIL_CHAT_IDS = {}
-
-# Shared chat for the whole complex, offered on top of the building chat
-PUBLIC_CHAT_ID_RAW = os.environ.get("PUBLIC_CHAT_ID", "").strip()
-try:
-    PUBLIC_CHAT_ID: int | None = int(PUBLIC_CHAT_ID_RAW) if PUBLIC_CHAT_ID_RAW else None
-except Exception:
-    logging.error("PUBLIC_CHAT_ID must be an integer chat id (e.g., -1001234567890)")
-    PUBLIC_CHAT_ID = None
-
-# Every building of the complex, including those without their own chat yet:
-# their residents still register and get access to the shared chat
-# Example format for BUILDINGS env: 2,2к1,2к4,2к5
-BUILDINGS_RAW = os.environ.get("BUILDINGS", "")
-BUILDINGS: list[str] = list(dict.fromkeys(
-    [part.strip() for part in BUILDINGS_RAW.split(",") if part.strip()] + list(GROUP_CHAT_IDS)
-))
-
+# Optional Bot API server instead of api.telegram.org: a self-hosted one or the benchmark stand-in
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").strip().rstrip("/")
+TELEGRAM_MESSAGE_LIMIT = 4096
 # Users allowed to run admin commands in any building chat, regardless of their status there
 # Example format for OWNER_IDS env: 230720971,987654321
 OWNER_IDS_RAW = os.environ.get("OWNER_IDS", "")
@@ -85,63 +55,88 @@ except Exception:
     logging.error("OWNER_IDS must be a comma-separated list of Telegram user ids (e.g., 230720971)")
     OWNER_IDS = set()
 
-logging.basicConfig(level=logging.INFO)
-bot = Bot(token=TELEGRAM_KEY)
-dp = Dispatcher()
+# Webhook mode is used when WEBHOOK_URL is set (public https base, e.g. https://bot.example.com),
+# otherwise the bot falls back to long polling. Both serve the liveness route on PORT
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_PATH = "/" + os.environ.get("WEBHOOK_PATH", "/webhook").strip().strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "").strip() or None
+PORT_RAW = os.environ.get("PORT", "80").strip()
+try:
+    PORT: int = int(PORT_RAW)
+except Exception:
+    logging.error("PORT must be an integer (e.g., 80)")
+    PORT = 80
+
+# How long a /readyz answer is reused, so frequent probes do not turn into API and database traffic
+READINESS_CACHE_SECONDS = 5.0
+READINESS_CHECK_TIMEOUT = 5.0
+
+# Created by main(): importing this module opens no connections
+bot: Bot | None = None
+dp = Dispatcher(storage=fsm_storage.create_storage())
+metrics.setup(dp)
+diagnostics.setup(dp)
+logs.setup(dp)
+metrics.stats.add("resident_cache", database.resident_cache.stats)
+metrics.stats.add("membership_index", membership.index.stats)
+metrics.stats.add("send_queue", sender.scheduler.stats)
+metrics.stats.add("invite_pool", invites.pool.stats)
+metrics.stats.add("join_batcher", join_batcher.batcher.stats)
+metrics.stats.add("reconciler", reconciler.reconciler.stats)
+metrics.stats.add("logging", logs.stats)
+metrics.stats.add("throttle", throttle.limiter.stats)
+metrics.stats.add("join_digest", digest.digest.stats)
+metrics.stats.add("replica", replica.replica.stats)
+metrics.stats.add("registration_stats", registration_stats.cache.stats)
+metrics.stats.add("db_breaker", database.breaker.stats)
+metrics.stats.add("db_lookups", database.lookups.stats)
+metrics.stats.add("admin_roster", admins.roster.stats)
+metrics.stats.add("outbox", outbox.outbox.stats)
 
 
 def resolve_building_chat_id(building: str) -> int | None:
-    return GROUP_CHAT_IDS.get(building)
+    return registry.current.group_chat_ids.get(building)
 
 
 def resolve_chat_building(chat_id: int) -> str | None:
-    for building_name, configured_chat_id in GROUP_CHAT_IDS.items():
-        if configured_chat_id == chat_id:
-            return building_name
-    return None
+    return registry.current.chat_buildings.get(chat_id)
 
 
 def resolve_building_council_chat_id(building: str) -> int | None:
-    return COUNCIL_CHAT_IDS.get(building)
+    return registry.current.council_chat_ids.get(building)
 
 
-def all_connected_chat_ids() -> list[int]:
-    chat_ids = list(GROUP_CHAT_IDS.values())
-    if PUBLIC_CHAT_ID is not None:
-        chat_ids.append(PUBLIC_CHAT_ID)
-    return list(dict.fromkeys(chat_ids))
+def all_connected_chat_ids() -> tuple[int, ...]:
+    return registry.current.connected_chat_ids
 
 
 def is_connected_chat(chat_id: int) -> bool:
-    return chat_id in all_connected_chat_ids()
+    return chat_id in registry.current.connected
 
 
 def resolve_chat_title(chat_id: int) -> str:
     building = resolve_chat_building(chat_id)
     if building is not None:
         return f"Чат дома {building}"
-    if PUBLIC_CHAT_ID is not None and chat_id == PUBLIC_CHAT_ID:
+    if chat_id == registry.current.public_chat_id:
         return "Общий чат ЖК"
     return "Чат"
 
 
-def build_building_keyboard() -> InlineKeyboardBuilder:
-    keyboard = InlineKeyboardBuilder()
-    for building_name in BUILDINGS:
-        keyboard.button(
-            text=building_name,
-            callback_data=f"building_{building_name}"
-        )
-    keyboard.adjust(4)
-    return keyboard
+def building_keyboard() -> InlineKeyboardMarkup:
+    return registry.current.building_keyboard
 
 
 async def is_chat_admin(chat_id: int, user_id: int) -> bool:
+    # The prefetched roster answers without an API call; the lookup is only for chats it failed to load
+    known = admins.roster.is_admin(chat_id, user_id)
+    if known is not None:
+        return known
     try:
-        member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-        return getattr(member, "status", None) in ["administrator", "creator"]
+        status = await membership.index.get_status(bot, chat_id, user_id)
+        return status in ["administrator", "creator"]
     except Exception as err:
-        logging.info(f"Admin check failed for user {user_id} in chat {chat_id}: {err}")
+        logging.info("Admin check failed for user %s in chat %s: %s", user_id, chat_id, err, extra=logs.SAMPLED)
         return False
 
 
@@ -156,6 +151,20 @@ async def can_use_admin_commands(message: Message) -> bool:
     return await is_chat_admin(message.chat.id, message.from_user.id)
 
 
+# Only admins count against a chat's shared admin limit; a refused non-admin costs the chat nothing.
+# Admin commands do nothing outside the connected chats, so there the answer is no without a lookup
+async def is_admin_update(event) -> bool:
+    chat = event.chat if isinstance(event, Message) else event.message.chat if event.message is not None else None
+    if chat is None or not is_connected_chat(chat.id):
+        return False
+    if isinstance(event, Message):
+        return await can_use_admin_commands(event)
+    return event.from_user.id in OWNER_IDS or await is_chat_admin(chat.id, event.from_user.id)
+
+
+throttle.setup(dp, is_admin_update)
+
+
 def format_user_name(user: types.User) -> str:
     full_name = f"{user.first_name or ''} {user.last_name or ''}".strip() or "Сосед"
     return f"{full_name} (@{user.username})" if user.username else full_name
@@ -165,25 +174,31 @@ async def answer_admin_privately(message: Message, text: str) -> None:
     # Anonymous admins act on behalf of the group and have no personal chat with the bot
     if message.sender_chat is None and message.from_user is not None:
         try:
-            await bot.send_message(chat_id=message.from_user.id, text=text)
+            await sender.scheduler.submit(
+                SendMessage(chat_id=message.from_user.id, text=text),
+                priority=sender.URGENT
+            )
             return
         except Exception as err:
-            logging.info(f"Could not answer admin {message.from_user.id} privately: {err}")
+            logging.info("Could not answer admin %s privately: %s", message.from_user.id, err)
             text += "\n\nЧтобы получать ответы бота в личных сообщениях, откройте диалог с ботом и отправьте /start"
-    await message.answer(text)
+    await sender.scheduler.submit(message.answer(text), priority=sender.URGENT)
 
 
 async def is_user_in_chat(chat_id: int, user_id: int) -> bool:
     try:
-        member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-        status = getattr(member, "status", None)
+        status = await membership.index.get_status(bot, chat_id, user_id)
         return status in ["member", "administrator", "creator"]
     except Exception as err:
-        logging.info(f"Membership check failed for user {user_id} in chat {chat_id}: {err}")
+        logging.info("Membership check failed for user %s in chat %s: %s", user_id, chat_id, err, extra=logs.SAMPLED)
         return False
 
 
 async def create_one_time_invite_link(chat_id: int) -> str | None:
+    # Normally served from the pool; a link is created on the spot only when the pool ran dry
+    pooled_link = invites.pool.take(chat_id)
+    if pooled_link is not None:
+        return pooled_link
     try:
         invite = await bot.create_chat_invite_link(
             chat_id=chat_id,
@@ -191,7 +206,7 @@ async def create_one_time_invite_link(chat_id: int) -> str | None:
         )
         return invite.invite_link
     except Exception as err:
-        logging.error(f"Error creating invite link for chat {chat_id}: {err}")
+        logging.error("Error creating invite link for chat %s: %s", chat_id, err)
         return None
 
 
@@ -240,25 +255,22 @@ async def on_report_emergency(callback: types.CallbackQuery):
     )
 
 
-def has_user_record(telegram_id: int, building: str | None = None) -> bool:
+async def has_user_record(telegram_id: int, building: str | None = None) -> bool:
     try:
-        query = supabase.table("users").select("id").eq("telegram_id", telegram_id)
-        if building is not None:
-            query = query.eq("building", building)
-        return bool(query.limit(1).execute().data)
+        return await database.find_user_record(telegram_id, building)
     except Exception as err:
         # Treat a lookup failure as "no record": ask again instead of trusting a broken check
-        logging.error(f"Record lookup failed for user {telegram_id}: {err}")
+        logging.error("Record lookup failed for user %s: %s", telegram_id, err)
         return False
 
 
 # Consent is remembered through the records the user already has in the database
-def has_given_consent(telegram_id: int) -> bool:
-    return has_user_record(telegram_id)
+async def has_given_consent(telegram_id: int) -> bool:
+    return await has_user_record(telegram_id)
 
 
 async def prompt_building_selection(message: Message, state: FSMContext, intro: str | None = None) -> None:
-    if not BUILDINGS:
+    if not registry.current.buildings:
         await state.clear()
         await message.answer(
             "К сожалению, сейчас не подключен ни один чат. Свяжитесь с администратором @xmlChay (Илья)."
@@ -270,15 +282,15 @@ async def prompt_building_selection(message: Message, state: FSMContext, intro:
         text = f"{intro}\n\n{text}"
 
     await state.set_state(JoinChat.selecting_building)
-    await message.answer(text, reply_markup=build_building_keyboard().as_markup())
+    await message.answer(text, reply_markup=building_keyboard())
 
 
 # Callback: 💬 Вступить в чат
-@dp.callback_query(F.data == "start_join_chat")
+@dp.callback_query(F.data == "start_join_chat", flags={"throttle": "registration"})
 async def on_join_chat(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
-    if has_given_consent(callback.from_user.id):
+    if await has_given_consent(callback.from_user.id):
         await prompt_building_selection(
             callback.message,
             state,
@@ -302,7 +314,7 @@ async def on_join_chat(callback: types.CallbackQuery, state: FSMContext):
 
 
 # Message: consent response → ask for building or decline
-@dp.message(JoinChat.consent_share_flat, F.text.in_(["✅ Согласен"]))
+@dp.message(JoinChat.consent_share_flat, F.text.in_(["✅ Согласен"]), flags={"throttle": "registration"})
 async def on_consent_yes(message: Message, state: FSMContext):
     await prompt_building_selection(message, state)
 
@@ -326,17 +338,17 @@ async def on_consent_invalid(message: Message):
 
 
 # Callback: building selected → ask for flat number
-@dp.callback_query(JoinChat.selecting_building, F.data.startswith("building_"))
+@dp.callback_query(JoinChat.selecting_building, F.data.startswith("building_"), flags={"throttle": "registration"})
 async def on_building_selected(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     selected = callback.data.split("_", 1)[1]
 
     # Config may have changed since the keyboard was sent
-    if selected not in BUILDINGS:
+    if selected not in registry.current.buildings:
         await state.set_state(JoinChat.selecting_building)
         await callback.message.edit_text(
             f"К сожалению, дом {selected} пока не поддерживается. Выберите другой дом:",
-            reply_markup=build_building_keyboard().as_markup()
+            reply_markup=building_keyboard()
         )
         return
 
@@ -349,7 +361,7 @@ async def on_building_selected(callback: types.CallbackQuery, state: FSMContext)
 
 
 # Message: valid flat number received → confirm and clear state
-@dp.message(JoinChat.awaiting_flat_number, F.text.regexp(r"^\d{1,5}$"))
+@dp.message(JoinChat.awaiting_flat_number, F.text.regexp(r"^\d{1,5}$"), flags={"throttle": "registration"})
 async def on_flat_number(message: Message, state: FSMContext):
     try:
         data = await state.get_data()
@@ -364,30 +376,27 @@ async def on_flat_number(message: Message, state: FSMContext):
 
         async def finish(text: str):
             try:
-                await processing_message.edit_text(text)
+                await sender.scheduler.submit(processing_message.edit_text(text), priority=sender.URGENT)
             except Exception:
-                await message.answer(text)
+                await sender.scheduler.submit(message.answer(text), priority=sender.URGENT)
             await state.clear()
 
-        # Exact-duplicate check (allow multiple flats, but not the same flat twice)
-        existing_flat = supabase.table("users").select("id").eq("telegram_id", telegram_id).eq("building", building).eq("flat_number", flat_number).execute()
-
-        # Insert record if it's not an exact duplicate
-        if not existing_flat.data:
-            user_data = {
-                "telegram_id": telegram_id,
-                "username": username,
-                "first_name": first_name,
-                "last_name": last_name,
-                "building": building,
-                "flat_number": flat_number,
-                "joined_at": "now()"
-            }
-            try:
-                supabase.table("users").insert(user_data).execute()
-            except Exception as insert_err:
-                logging.error(f"Insert failed (continuing as duplicate-safe): {insert_err}")
-                # If a UNIQUE constraint exists server-side, treat as duplicate and continue
+        # Multiple flats are allowed, the same flat twice is skipped by the unique key
+        user_data = {
+            "telegram_id": telegram_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "building": building,
+            "flat_number": flat_number,
+            "joined_at": "now()"
+        }
+        try:
+            await database.register_flat(user_data)
+        except database.DatabaseUnavailable as err:
+            # Written once the database is back; the invites below do not need to wait for it
+            logging.warning("Database unavailable, registration of user %s queued: %s", telegram_id, err)
+            await outbox.outbox.add_registration(user_data)
 
         # Offer an invite per chat, skipping the ones the user is already in
         async def describe_chat_access(chat_id: int, emoji: str, title: str, already_in_text: str) -> str:
@@ -402,6 +411,8 @@ async def on_flat_number(message: Message, state: FSMContext):
             )
 
         lines = [f"Готово! Дом {building}, квартира {flat_number}."]
+        accesses = []
+        public_chat_id = registry.current.public_chat_id
 
         building_chat_id = resolve_building_chat_id(building)
         if building_chat_id is None:
@@ -410,25 +421,28 @@ async def on_flat_number(message: Message, state: FSMContext):
                 "вы сможете получить приглашение по команде /start"
             )
         else:
-            lines.append(await describe_chat_access(
+            accesses.append((
                 building_chat_id,
                 "🏠",
                 f"Чат дома {building}",
                 f"Вы уже состоите в чате дома {building}, приглашение не требуется."
             ))
 
-        if PUBLIC_CHAT_ID is not None:
-            lines.append(await describe_chat_access(
-                PUBLIC_CHAT_ID,
+        if public_chat_id is not None:
+            accesses.append((
+                public_chat_id,
                 "🏘",
                 "Общий чат ЖК",
                 "Вы уже состоите в общем чате ЖК, приглашение не требуется."
             ))
 
+        # Both chats are checked at once; the order of the lines stays the same
+        lines.extend(await fanout.gather_limited(accesses, lambda access: describe_chat_access(*access)))
+
         await finish("\n\n".join(lines))
 
     except Exception as e:
-        logging.error(f"Error storing user data: {e}")
+        logging.error("Error storing user data: %s", e)
         await message.answer(
             "Произошла ошибка при сохранении данных. Пожалуйста, обратитесь к разработчику @xmlChay (Илья)"
         )
@@ -440,8 +454,76 @@ async def on_flat_number_invalid(message: Message):
     await message.answer("Пожалуйста, укажите корректный номер квартиры")
 
 
+def split_message(blocks: list[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    # Blocks are never cut in the middle, so a resident's lines always stay in one message
+    messages = []
+    current = ""
+    for block in blocks:
+        block = block[:limit]
+        if current and len(current) + 2 + len(block) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{block}" if current else block
+    if current:
+        messages.append(current)
+    return messages
+
+
+async def send_flat_page(chat_id: int, flat_number: str, offset: int) -> None:
+    building = resolve_chat_building(chat_id)
+    records, has_more = await database.fetch_flat_residents(flat_number, building, offset)
+
+    if not records:
+        # A later page can come up empty when records were removed after the first one was shown
+        lines = ["Данные не найдены в базе" if offset == 0 else "Больше записей нет", ""]
+        if building is not None:
+            lines.append(f"Дом: {building}")
+        lines.append(f"Квартира: {flat_number}")
+        await sender.scheduler.submit(SendMessage(chat_id=chat_id, text="\n".join(lines)), priority=sender.URGENT)
+        return
+
+    # Build message similar to join notification but for flat lookup
+    header = ["ℹ️ Данные по квартире", ""]
+    if building is not None:
+        header.append(f"Дом: {building}")
+    header.append(f"Квартира: {flat_number}")
+    if offset > 0 or has_more:
+        header.append(f"Записи {offset + 1}–{offset + len(records)}")
+    header.append("")
+    header.append("Пользователи:")
+    blocks = ["\n".join(header)]
+
+    for rec in records:
+        user_id = rec.get("telegram_id")
+        username = rec.get("username") or "Unknown"
+        first_name = rec.get("first_name") or "Unknown"
+        last_name = rec.get("last_name") or ""
+        user_line = (
+            f"@{username if username != 'Unknown' else '—'} (ID: {user_id})\n"
+            f"Имя: {first_name} {last_name}".strip()
+        )
+        if building is None:
+            user_line += f"\nДом: {rec.get('building') or '—'}"
+        blocks.append(user_line)
+
+    texts = split_message(blocks)
+    for index, text in enumerate(texts):
+        reply_markup = None
+        if has_more and index == len(texts) - 1:
+            keyboard = InlineKeyboardBuilder()
+            keyboard.button(
+                text="Следующая страница ▶️",
+                callback_data=f"flat_page:{flat_number}:{offset + len(records)}"
+            )
+            reply_markup = keyboard.as_markup()
+        await sender.scheduler.submit(
+            SendMessage(chat_id=chat_id, text=text, reply_markup=reply_markup),
+            priority=sender.URGENT
+        )
+
+
 # /flat: show users bound to a flat (connected chats, admins only)
-@dp.message(Command("flat"))
+@dp.message(Command("flat"), flags={"throttle": "admin"})
 async def handle_flat_command(message: Message):
     # Restrict to connected chats; in the shared chat the search covers every building
     if not is_connected_chat(message.chat.id):
@@ -450,8 +532,6 @@ async def handle_flat_command(message: Message):
     if not await can_use_admin_commands(message):
         return
 
-    building = resolve_chat_building(message.chat.id)
-
     # Parse flat number from command arguments
     # Expected formats:
     #   /flat 123
@@ -464,53 +544,291 @@ async def handle_flat_command(message: Message):
     flat_number = args_text[1].strip()
 
     try:
-        query = supabase.table("users").select("*").eq("flat_number", flat_number)
-        if building is not None:
-            query = query.eq("building", building)
-        result = query.execute()
-
-        if not result.data:
-            lines = ["Данные не найдены в базе", ""]
-            if building is not None:
-                lines.append(f"Дом: {building}")
-            lines.append(f"Квартира: {flat_number}")
-            await message.answer("\n".join(lines))
+        await send_flat_page(message.chat.id, flat_number, 0)
+    except Exception as e:
+        logging.error("/flat: error fetching data: %s", e)
+        await message.answer("Произошла ошибка при получении данных. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)")
+
+
+# /flat "next page" button: same rights as the command itself, checked again for whoever pressed it
+@dp.callback_query(F.data.startswith("flat_page:"), flags={"throttle": "admin"})
+async def on_flat_page(callback: types.CallbackQuery):
+    chat = callback.message.chat if callback.message is not None else None
+    if chat is None or not is_connected_chat(chat.id):
+        await callback.answer()
+        return
+    if callback.from_user.id not in OWNER_IDS and not await is_chat_admin(chat.id, callback.from_user.id):
+        await callback.answer("Доступно только администраторам", show_alert=True)
+        return
+
+    try:
+        _, flat_number, offset = callback.data.split(":")
+        offset = int(offset)
+    except ValueError:
+        await callback.answer()
+        return
+
+    await callback.answer()
+    try:
+        # The button has done its job; the next page comes with its own
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    try:
+        await send_flat_page(chat.id, flat_number, offset)
+    except Exception as e:
+        logging.error("/flat: error fetching page %s of flat %s: %s", offset, flat_number, e)
+        await sender.scheduler.submit(
+            SendMessage(
+                chat_id=chat.id,
+                text="Произошла ошибка при получении данных. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)"
+            ),
+            priority=sender.URGENT
+        )
+
+
+# /who and /flats read the local replica: answers come without a database round trip, outages included
+SEARCH_RESULT_LIMIT = 50
+FLATS_RESULT_LIMIT = 200
+REPLICA_NOT_READY_TEXT = "Поиск пока недоступен: данные еще загружаются. Попробуйте через минуту."
+
+
+async def send_text_blocks(chat_id: int, blocks: list[str]) -> None:
+    for text in split_message(blocks):
+        await sender.scheduler.submit(SendMessage(chat_id=chat_id, text=text), priority=sender.URGENT)
+
+
+def format_resident(rec: dict) -> str:
+    username = rec.get("username") or "Unknown"
+    return f"@{username if username != 'Unknown' else '—'} (ID: {rec.get('telegram_id')})"
+
+
+# /who: find residents by Telegram ID, @username or name (connected chats, admins only)
+@dp.message(Command("who"), flags={"throttle": "admin"})
+async def handle_who_command(message: Message):
+    if not is_connected_chat(message.chat.id):
+        return
+
+    if not await can_use_admin_commands(message):
+        return
+
+    # Expected formats:
+    #   /who 123456789
+    #   /who @username
+    #   /who Иван   (the beginning of a name, first or last)
+    args_text = (message.text or message.caption or "").split(maxsplit=1)
+    if len(args_text) < 2 or not args_text[1].strip().lstrip("@"):
+        await message.answer("Укажите Telegram ID, @username или имя: например, /who @ivan")
+        return
+    if not replica.replica.loaded:
+        await message.answer(REPLICA_NOT_READY_TEXT)
+        return
+
+    query = args_text[1].strip()
+    building = resolve_chat_building(message.chat.id)
+    try:
+        records = replica.replica.find_users(query, building, SEARCH_RESULT_LIMIT + 1)
+        if not records:
+            await message.answer(f"По запросу «{query}» никого не найдено")
             return
 
-        # Build message similar to join notification but for flat lookup
-        lines = ["ℹ️ Данные по квартире", ""]
-        if building is not None:
-            lines.append(f"Дом: {building}")
-        lines.append(f"Квартира: {flat_number}")
+        blocks = [f"🔎 Найдено по запросу «{query}»:"]
+        residents: dict[int, list[dict]] = {}
+        for rec in records[:SEARCH_RESULT_LIMIT]:
+            residents.setdefault(rec["telegram_id"], []).append(rec)
+        for user_records in residents.values():
+            first = user_records[0]
+            lines = [
+                format_resident(first),
+                f"Имя: {first.get('first_name') or 'Unknown'} {first.get('last_name') or ''}".strip(),
+            ]
+            flats_by_building: dict[str, list[str]] = {}
+            for rec in user_records:
+                flats_by_building.setdefault(rec.get("building") or "—", []).append(rec.get("flat_number") or "—")
+            for flat_building, flat_numbers in flats_by_building.items():
+                lines.append(f"Дом {flat_building}: кв. {', '.join(flat_numbers)}")
+            blocks.append("\n".join(lines))
+        if len(records) > SEARCH_RESULT_LIMIT:
+            blocks.append(f"Показаны первые {SEARCH_RESULT_LIMIT} записей — уточните запрос")
+        await send_text_blocks(message.chat.id, blocks)
+    except Exception as e:
+        logging.error("/who: error searching: %s", e)
+        await message.answer("Произошла ошибка при поиске. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)")
+
+
+# /flats: residents of a range of flats (connected chats, admins only)
+@dp.message(Command("flats"), flags={"throttle": "admin"})
+async def handle_flats_command(message: Message):
+    if not is_connected_chat(message.chat.id):
+        return
+
+    if not await can_use_admin_commands(message):
+        return
+
+    # Expected formats; outside a building chat the building is optional:
+    #   /flats 100-150
+    #   /flats 100–150 2к1
+    #   /flats 12
+    args = (message.text or message.caption or "").split()[1:]
+    flat_range = args[0].replace("–", "-").split("-") if args else []
+    if len(flat_range) not in [1, 2] or not all(part.isdigit() for part in flat_range):
+        await message.answer("Укажите квартиры: например, /flats 100-150")
+        return
+    first, last = int(flat_range[0]), int(flat_range[-1])
+    if first > last:
+        first, last = last, first
+
+    building = resolve_chat_building(message.chat.id)
+    if building is None and len(args) > 1:
+        building = args[1]
+        if building not in registry.current.buildings:
+            await message.answer(f"Дом {building} не найден. Доступные дома: {', '.join(registry.current.buildings)}")
+            return
+    if not replica.replica.loaded:
+        await message.answer(REPLICA_NOT_READY_TEXT)
+        return
+
+    scope = f"дом {building}" if building is not None else "все дома"
+    flats_title = f"Квартиры {first}–{last}" if first != last else f"Квартира {first}"
+    try:
+        records = replica.replica.find_flats(first, last, building, FLATS_RESULT_LIMIT + 1)
+        if not records:
+            await message.answer(f"{flats_title} ({scope}): данные не найдены в базе")
+            return
+
+        blocks = [f"ℹ️ {flats_title} ({scope}):"]
+        flats: dict[tuple[str, str], list[dict]] = {}
+        for rec in records[:FLATS_RESULT_LIMIT]:
+            flats.setdefault((rec.get("building") or "—", rec.get("flat_number") or "—"), []).append(rec)
+        for (flat_building, flat_number), flat_records in flats.items():
+            title = f"Кв. {flat_number}" if building is not None else f"Дом {flat_building}, кв. {flat_number}"
+            blocks.append(f"{title}: {', '.join(format_resident(rec) for rec in flat_records)}")
+        if len(records) > FLATS_RESULT_LIMIT:
+            blocks.append(f"Показаны первые {FLATS_RESULT_LIMIT} записей — сузьте диапазон")
+        await send_text_blocks(message.chat.id, blocks)
+    except Exception as e:
+        logging.error("/flats: error searching: %s", e)
+        await message.answer("Произошла ошибка при поиске. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)")
+
+
+def format_stats(snapshot: registration_stats.Snapshot, building: str | None) -> list[str]:
+    stats_cache = registration_stats.cache
+    fetched_at = stats_cache.fetched_at(snapshot).strftime("%d.%m %H:%M")
+    scope = f"дом {building}" if building is not None else "все дома"
+    blocks = []
+
+    lines = [f"📊 Регистрации: {scope} (данные на {fetched_at})", ""]
+    if building is None:
+        for row_building in registry.current.buildings:
+            row = stats_cache.building_row(snapshot, row_building)
+            lines.append(f"Дом {row_building}: квартир {row['flats']}, жителей {row['residents']}")
+        # Buildings no longer configured still have their records counted in the total
+        total = stats_cache.building_row(snapshot, None)
         lines.append("")
-        lines.append("Пользователи:")
+        lines.append(f"Всего: квартир {total['flats']}, жителей {total['residents']}, записей {total['registrations']}")
+    else:
+        row = stats_cache.building_row(snapshot, building)
+        lines.append(f"Квартир: {row['flats']}")
+        lines.append(f"Жителей: {row['residents']}")
+        lines.append(f"Записей: {row['registrations']}")
+    blocks.append("\n".join(lines))
+
+    daily = stats_cache.daily_counts(snapshot, building)
+    lines = [f"Новые записи за {len(daily)} дн.: {sum(count for _, count in daily)}"]
+    lines.extend(f"{day.strftime('%d.%m')} — {count}" for day, count in daily)
+    blocks.append("\n".join(lines))
+    return split_message(blocks)
+
+
+# /stats: registered flats and residents, and new records per day (connected chats, admins only)
+@dp.message(Command("stats"), flags={"throttle": "admin"})
+async def handle_stats_command(message: Message):
+    if not is_connected_chat(message.chat.id):
+        return
 
-        records = result.data
-        if building is None:
-            records = sorted(records, key=lambda rec: str(rec.get("building") or ""))
-
-        for rec in records:
-            user_id = rec.get("telegram_id")
-            username = rec.get("username") or "Unknown"
-            first_name = rec.get("first_name") or "Unknown"
-            last_name = rec.get("last_name") or ""
-            user_line = (
-                f"@{username if username != 'Unknown' else '—'} (ID: {user_id})\n"
-                f"Имя: {first_name} {last_name}".strip()
+    if not await can_use_admin_commands(message):
+        return
+
+    # The shared chat sees the whole complex, a building chat only its own building
+    building = resolve_chat_building(message.chat.id)
+    try:
+        snapshot = await registration_stats.cache.get()
+        await send_text_blocks(message.chat.id, format_stats(snapshot, building))
+    except Exception as e:
+        logging.error("/stats: error fetching data: %s", e)
+        await message.answer("Произошла ошибка при получении статистики. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)")
+
+
+# /export: a building's registrations as a CSV file, sent to the admin privately (connected chats, admins only)
+@dp.message(Command("export"), flags={"throttle": "export"})
+async def handle_export_command(message: Message):
+    if not is_connected_chat(message.chat.id):
+        return
+
+    if not await can_use_admin_commands(message):
+        return
+
+    # In a building chat the building comes from the chat; elsewhere it is optional:
+    #   /export      — every building
+    #   /export 2к1  — one building
+    building = resolve_chat_building(message.chat.id)
+    args_text = (message.text or message.caption or "").split(maxsplit=1)
+    if building is None and len(args_text) > 1:
+        building = args_text[1].strip()
+        if building not in registry.current.buildings:
+            await answer_admin_privately(
+                message,
+                f"Дом {building} не найден. Доступные дома: {', '.join(registry.current.buildings)}"
             )
-            if building is None:
-                user_line += f"\nДом: {rec.get('building') or '—'}"
-            lines.append(user_line)
-            lines.append("")
+            return
 
-        await message.answer("\n".join(lines).strip())
+    # The file holds personal data of every resident: it never goes to a group chat
+    if message.sender_chat is not None or message.from_user is None:
+        await message.answer("Выгрузка отправляется только в личные сообщения — отправьте команду от своего имени")
+        return
+
+    export_file = tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8-sig", newline="", suffix=".csv", prefix="export_", delete=False
+    )
+    try:
+        rows_count = 0
+        with export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(database.EXPORT_COLUMNS)
+            async for rows in database.iter_registrations(building):
+                writer.writerows([[row.get(column) for column in database.EXPORT_COLUMNS] for row in rows])
+                rows_count += len(rows)
+
+        scope = f"дом {building}" if building is not None else "все дома"
+        filename = f"residents_{building or 'all'}_{datetime.date.today().isoformat()}.csv"
+        try:
+            await sender.scheduler.submit(
+                SendDocument(
+                    chat_id=message.from_user.id,
+                    document=FSInputFile(export_file.name, filename=filename),
+                    caption=f"📄 Выгрузка: {scope}, записей: {rows_count}"
+                ),
+                priority=sender.NORMAL
+            )
+        except Exception as err:
+            logging.info("/export: could not send the file to admin %s: %s", message.from_user.id, err)
+            await message.answer(
+                "Не удалось отправить выгрузку. Откройте диалог с ботом, отправьте /start и повторите команду"
+            )
+            return
+        logging.info("/export: %s rows (%s) sent to admin %s", rows_count, scope, message.from_user.id)
     except Exception as e:
-        logging.error(f"/flat: error fetching data: {e}")
-        await message.answer("Произошла ошибка при получении данных. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)")
+        logging.error("/export: error fetching data: %s", e)
+        await answer_admin_privately(
+            message,
+            "Произошла ошибка при выгрузке данных. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)"
+        )
+    finally:
+        os.remove(export_file.name)
 
 
 # /kick: remove a user from the chat by Telegram ID (connected chats, admins only)
-@dp.message(Command("kick"))
+@dp.message(Command("kick"), flags={"throttle": "admin"})
 async def handle_kick_command(message: Message):
     # Restrict to connected chats
     if not is_connected_chat(message.chat.id):
@@ -539,11 +857,12 @@ async def handle_kick_command(message: Message):
     try:
         target = await bot.get_chat_member(chat_id=message.chat.id, user_id=target_id)
     except Exception as err:
-        logging.info(f"/kick: cannot get member {target_id} in chat {message.chat.id}: {err}")
+        logging.info("/kick: cannot get member %s in chat %s: %s", target_id, message.chat.id, err)
         await answer_admin_privately(message, f"{chat_title}: пользователь с ID {target_id} не найден")
         return
 
     target_status = getattr(target, "status", None)
+    membership.index.record_event(message.chat.id, target_id, target_status)
     if target_status in ["left", "kicked"]:
         await answer_admin_privately(message, f"{chat_title}: пользователь с ID {target_id} не состоит в чате")
         return
@@ -560,15 +879,19 @@ async def handle_kick_command(message: Message):
         # Ban and immediately unban, so the user is removed but can return later
         await bot.ban_chat_member(chat_id=message.chat.id, user_id=target_id)
         await bot.unban_chat_member(chat_id=message.chat.id, user_id=target_id, only_if_banned=True)
+        membership.index.record_event(message.chat.id, target_id, "left")
     except Exception as err:
-        logging.error(f"/kick: failed to remove user {target_id} from chat {message.chat.id}: {err}")
+        logging.error("/kick: failed to remove user %s from chat %s: %s", target_id, message.chat.id, err)
         await answer_admin_privately(
             message,
             "Не удалось исключить пользователя. Проверьте, что у бота есть право удалять участников"
         )
         return
 
-    logging.info(f"/kick: user {target_name} (ID: {target_id}) removed from chat {message.chat.id} ({chat_title}).")
+    logging.info(
+        "/kick: user %s (ID: %s) removed from chat %s (%s).",
+        target_name, target_id, message.chat.id, chat_title
+    )
     await answer_admin_privately(message, f"🚫 {chat_title}: пользователь {target_name} исключен")
 
 
@@ -583,19 +906,125 @@ async def on_chat_join_request(request: ChatJoinRequest):
     user_id = request.from_user.id
 
     # A building chat is only for residents of that building; the shared chat is for anyone registered
+    # Requests arriving together share one database query
     building = resolve_chat_building(request.chat.id)
-    if not has_user_record(user_id, building):
+    try:
+        registered = await join_batcher.batcher.has_record(user_id, building)
+    except database.DatabaseUnavailable as err:
+        # A registration queued during the outage is as good as a stored one
+        pending = await outbox.outbox.pending_buildings(user_id)
+        registered = bool(pending) if building is None else building in pending
+        if not registered:
+            await outbox.outbox.park_join_request(request.chat.id, user_id, user_name, building)
+            logging.warning(
+                "Join request from %s (ID: %s) to %s parked until the database is back: %s",
+                user_name, user_id, chat_title, err
+            )
+            return
+    except Exception as err:
+        logging.error("Record lookup failed for user %s: %s", user_id, err)
+        registered = False
+    if not registered:
+        logging.info(
+            "Join request from %s (ID: %s) to %s left for manual review: no matching record in the database",
+            user_name, user_id, chat_title
+        )
+        return
+
+    await approve_join_request(request.chat.id, user_id, user_name, chat_title)
+
+
+async def approve_join_request(chat_id: int, user_id: int, user_name: str, chat_title: str) -> None:
+    try:
+        # Approvals are not chat messages: only the bot-wide rate limit applies
+        await sender.scheduler.submit(
+            ApproveChatJoinRequest(chat_id=chat_id, user_id=user_id),
+            priority=sender.URGENT,
+            chat_limited=False
+        )
+        logging.info("Approved join request from %s (ID: %s) to %s", user_name, user_id, chat_title)
+    except Exception as err:
+        logging.error("Failed to approve join request from %s to %s: %s", user_id, chat_title, err)
+
+
+# Decides a join request parked during an outage; DatabaseUnavailable keeps it parked for the next round
+async def reevaluate_join_request(chat_id: int, user_id: int, user_name: str, building: str | None) -> None:
+    if not is_connected_chat(chat_id):
+        return
+    chat_title = resolve_chat_title(chat_id)
+    if not await database.find_user_record(user_id, building):
         logging.info(
-            f"Join request from {user_name} (ID: {user_id}) to {chat_title} left for manual review: "
-            f"no matching record in the database"
+            "Parked join request from %s (ID: %s) to %s left for manual review: no matching record in the database",
+            user_name, user_id, chat_title
         )
         return
+    await approve_join_request(chat_id, user_id, user_name, chat_title)
 
+
+# Shown by name in a combined welcome; the rest are only counted
+WELCOME_NAMES_SHOWN = 10
+
+
+def format_welcome(display_names: list[str]) -> list[str]:
+    if len(display_names) == 1:
+        greeting = f"✅ Пользователь {display_names[0]} присоединился(-ась) к чату"
+    else:
+        shown = display_names[:WELCOME_NAMES_SHOWN]
+        others = len(display_names) - len(shown)
+        if others:
+            names = f"{', '.join(shown)} и еще {others}"
+        else:
+            names = f"{', '.join(shown[:-1])} и {shown[-1]}"
+        greeting = f"✅ К чату присоединились {names}"
+    return [
+        f"{greeting}\n\n"
+        "Добро пожаловать! Пожалуйста, уважайте своих соседей и не используйте чат для рекламы"
+    ]
+
+
+def format_council_join(join: dict) -> str:
+    username = join["username"] if join["username"] != "Unknown" else "—"
+    return f"Пользователь: @{username} (ID: {join['user_id']})\nИмя: {join['name']}"
+
+
+def format_council_notice(joins: list[dict]) -> list[str]:
+    building = joins[0]["building"]
+    if len(joins) == 1:
+        join = joins[0]
+        if not join["flats"]:
+            return [
+                "ℹ️ Пользователь присоединился к чату, но данные не найдены в базе\n\n"
+                f"Дом: {building}\n{format_council_join(join)}"
+            ]
+        flats_text = "\n".join(f"Квартира: {flat}" for flat in join["flats"])
+        return [
+            "✅ Пользователь присоединился к чату\n\n"
+            f"Дом: {building}\n{format_council_join(join)}\n\n"
+            f"Данные: \n{flats_text}"
+        ]
+    # A digest lists every newcomer with their flats, split across messages when it gets long
+    blocks = [f"✅ К чату присоединились {len(joins)} пользователя(-ей)\n\nДом: {building}"]
+    for join in joins:
+        flats_text = f"Квартиры: {', '.join(join['flats'])}" if join["flats"] else "Данные не найдены в базе"
+        blocks.append(f"{format_council_join(join)}\n{flats_text}")
+    return split_message(blocks)
+
+
+# Deletes right away, or queues the deletion while the database is down; the count then comes from the replica
+async def delete_user_data(user_id: int, building: str | None = None) -> tuple[int, bool]:
+    # A registration still waiting in the outbox would bring the data back after deletion.
+    # The outbox is local and secondary: if it fails, the database delete still goes ahead
     try:
-        await bot.approve_chat_join_request(chat_id=request.chat.id, user_id=user_id)
-        logging.info(f"Approved join request from {user_name} (ID: {user_id}) to {chat_title}")
+        count = await outbox.outbox.forget_user(user_id, building)
     except Exception as err:
-        logging.error(f"Failed to approve join request from {user_id} to {chat_title}: {err}")
+        logging.error("Outbox: could not drop queued registrations of user %s: %s", user_id, err)
+        count = 0
+    try:
+        return count + await database.delete_user_flats(user_id, building), False
+    except database.DatabaseUnavailable as err:
+        logging.warning("Database unavailable, deletion of user %s data queued: %s", user_id, err)
+        await outbox.outbox.add_deletion(user_id, building)
+        return count + len(replica.replica.find_users(str(user_id), building)), True
 
 
 # Chat member update handler - detect when users leave the group
@@ -603,12 +1032,26 @@ async def on_chat_join_request(request: ChatJoinRequest):
 async def on_chat_member_update(update: ChatMemberUpdated):
     # Only process updates for the building chats and the shared complex chat
     if not is_connected_chat(update.chat.id):
+        # Fires for every update of every foreign chat the bot sits in, hence sampled
         logging.info(
-            f"Ignoring chat_member update from unconfigured chat {update.chat.id} "
-            f"({update.chat.title}); check GROUP_CHAT_IDS and PUBLIC_CHAT_ID"
+            "Ignoring chat_member update from unconfigured chat %s (%s); check GROUP_CHAT_IDS and PUBLIC_CHAT_ID",
+            update.chat.id, update.chat.title,
+            extra=logs.SAMPLED
         )
         return
-    
+
+    # Telegram reports every status change here, so the index stays current without API calls
+    membership.index.record_event(
+        update.chat.id,
+        update.new_chat_member.user.id,
+        update.new_chat_member.status
+    )
+    admins.roster.apply_status(
+        update.chat.id,
+        update.new_chat_member.user.id,
+        update.new_chat_member.status
+    )
+
     # Check if user is no longer in the chat, whether they left or were removed
     if update.old_chat_member.status in ["member", "administrator", "creator"] and update.new_chat_member.status in ["left", "kicked"]:
         building = resolve_chat_building(update.chat.id)
@@ -620,32 +1063,23 @@ async def on_chat_member_update(update: ChatMemberUpdated):
         
         try:
             # Data is kept only while the user takes part in at least one connected chat
-            still_in_some_chat = False
-            for chat_id in all_connected_chat_ids():
-                if chat_id != update.chat.id and await is_user_in_chat(chat_id, user_id):
-                    still_in_some_chat = True
-                    break
+            other_chat_ids = [chat_id for chat_id in all_connected_chat_ids() if chat_id != update.chat.id]
+            still_in_some_chat = await fanout.find_first(
+                other_chat_ids,
+                lambda chat_id: is_user_in_chat(chat_id, user_id)
+            ) is not None
 
             # Leaving the shared chat costs nothing while the user stays in a building chat
             if still_in_some_chat and building is None:
                 return
 
-            select_query = supabase.table("users").select("*").eq("telegram_id", user_id)
-            delete_query = supabase.table("users").delete().eq("telegram_id", user_id)
-            if still_in_some_chat:
-                select_query = select_query.eq("building", building)
-                delete_query = delete_query.eq("building", building)
-
-            user_flats = select_query.execute()
-            if not user_flats.data:
+            flats_count, queued = await delete_user_data(user_id, building if still_in_some_chat else None)
+            if not flats_count:
                 return
 
-            delete_query.execute()
-            flats_count = len(user_flats.data)
-
             logging.info(
-                f"User {user_name} (ID: {user_id}) is no longer in chat {update.chat.id} "
-                f"({resolve_chat_title(update.chat.id)}). Removed {flats_count} flat(s) from database."
+                "User %s (ID: %s) is no longer in chat %s (%s). Removed %s flat(s) from database.",
+                user_name, user_id, update.chat.id, resolve_chat_title(update.chat.id), flats_count
             )
 
             if still_in_some_chat:
@@ -654,22 +1088,30 @@ async def on_chat_member_update(update: ChatMemberUpdated):
             else:
                 left_text = "вы больше не состоите в чатах ЖК"
                 data_text = f"Все ваши данные ({flats_count} квартир(а))"
+            deleted_text = (
+                "будут удалены из базы данных, как только она снова станет доступна,"
+                if queued
+                else "были удалены из базы данных"
+            )
 
             # Notify user in private message about data deletion
-            try:
-                await bot.send_message(
+            # User might have blocked the bot or deleted their account
+            sender.scheduler.submit(
+                SendMessage(
                     chat_id=user_id,
                     text=f"👋 {first_name}, {left_text}.\n\n"
-                         f"{data_text} были удалены из базы данных "
+                         f"{data_text} {deleted_text} "
                          f"в соответствии с политикой конфиденциальности.\n\n"
                          f"Если вы захотите вернуться в чат, просто начните заново с команды /start"
+                ),
+                priority=sender.NORMAL,
+                on_error=lambda notify_error: logging.error(
+                    "Error notifying user about data deletion: %s", notify_error
                 )
-            except Exception as notify_error:
-                logging.error(f"Error notifying user about data deletion: {notify_error}")
-                # User might have blocked the bot or deleted their account
+            )
                 
         except Exception as e:
-            logging.error(f"Error removing user data when leaving group: {e}")
+            logging.error("Error removing user data when leaving group: %s", e)
 
     # Check if user joined the chat
     if update.old_chat_member.status in ["left", "kicked"] and update.new_chat_member.status in ["member", "administrator", "creator"]:
@@ -684,62 +1126,57 @@ async def on_chat_member_update(update: ChatMemberUpdated):
         # Track registrations so admins can spot joins made outside the bot
         user_flats = None
         try:
-            registration_query = supabase.table("users").select("*").eq("telegram_id", user_id)
-            if building is not None:
-                registration_query = registration_query.eq("building", building)
-            user_flats = registration_query.execute()
-            if not user_flats.data:
+            user_flats = await database.fetch_user_flats(user_id, building)
+            if not user_flats:
                 logging.warning(
-                    f"User {display_name} (ID: {user_id}) joined {resolve_chat_title(update.chat.id)} "
-                    f"({update.chat.id}) without a record in the database."
+                    "User %s (ID: %s) joined %s (%s) without a record in the database.",
+                    display_name, user_id, resolve_chat_title(update.chat.id), update.chat.id
                 )
         except Exception as e:
-            logging.error(f"Error checking registration of joined user: {e}")
-
-        try:
-            await bot.send_message(
-                chat_id=update.chat.id,
-                text=(
-                    f"✅ Пользователь {display_name} присоединился(-ась) к чату\n\n"
-                    "Добро пожаловать! Пожалуйста, уважайте своих соседей и не используйте чат для рекламы"
-                )
+            logging.error("Error checking registration of joined user: %s", e)
+
+        # A burst of joins (a new chat filling up) becomes one post per window instead of one per user
+        chat_id = update.chat.id
+        digest.digest.add(
+            chat_id,
+            "welcome",
+            display_name,
+            format_welcome,
+            priority=sender.NORMAL,
+            on_error=lambda e: logging.error(
+                "Error welcoming user in chat %s (%s): %s", chat_id, resolve_chat_title(chat_id), e
             )
-        except Exception as e:
-            logging.error(f"Error welcoming user in chat {update.chat.id} ({resolve_chat_title(update.chat.id)}): {e}")
+        )
 
         # Detailed notification for the building council, if that chat is configured
         if building is not None:
             council_chat_id = resolve_building_council_chat_id(building)
             if council_chat_id is not None:
-                try:
-                    if user_flats and user_flats.data:
-                        flats_lines = [
-                            f"Квартира: {rec.get('flat_number', '—')}"
-                            for rec in user_flats.data
-                        ]
-                        flats_text = "\n".join(flats_lines)
-                        council_msg = (
-                            "✅ Пользователь присоединился к чату\n\n"
-                            f"Дом: {building}\n"
-                            f"Пользователь: @{username if username != 'Unknown' else '—'} (ID: {user_id})\n"
-                            f"Имя: {first_name} {last_name}".strip() + "\n\n"
-                            f"Данные: \n{flats_text}"
+                def report_council_error(e: Exception) -> None:
+                    if isinstance(e, TelegramMigrateToChat):
+                        logging.error(
+                            "Error notifying council of building %s: chat %s was upgraded to a supergroup. "
+                            "Update COUNCIL_CHAT_IDS to %s",
+                            building, council_chat_id, e.migrate_to_chat_id
                         )
                     else:
-                        council_msg = (
-                            "ℹ️ Пользователь присоединился к чату, но данные не найдены в базе\n\n"
-                            f"Дом: {building}\n"
-                            f"Пользователь: @{username if username != 'Unknown' else '—'} (ID: {user_id})\n"
-                            f"Имя: {first_name} {last_name}".strip()
-                        )
-                    await bot.send_message(chat_id=council_chat_id, text=council_msg)
-                except TelegramMigrateToChat as e:
-                    logging.error(
-                        f"Error notifying council of building {building}: chat {council_chat_id} "
-                        f"was upgraded to a supergroup. Update COUNCIL_CHAT_IDS to {e.migrate_to_chat_id}"
-                    )
-                except Exception as e:
-                    logging.error(f"Error notifying council of building {building}: {e}")
+                        logging.error("Error notifying council of building %s: %s", building, e)
+
+                council_join = {
+                    "building": building,
+                    "user_id": user_id,
+                    "username": username,
+                    "name": f"{first_name} {last_name}".strip(),
+                    "flats": [str(rec.get("flat_number", "—")) for rec in user_flats or []],
+                }
+                digest.digest.add(
+                    council_chat_id,
+                    f"council:{building}",
+                    council_join,
+                    format_council_notice,
+                    priority=sender.LOW,
+                    on_error=report_council_error
+                )
 
 
 # /revoke: user-initiated data deletion (private only)
@@ -762,41 +1199,41 @@ async def revoke_cancel(callback: types.CallbackQuery):
     await callback.message.edit_text("Операция отменена.")
 
 
-@dp.callback_query(F.data == "revoke_confirm")
+@dp.callback_query(F.data == "revoke_confirm", flags={"throttle": "registration"})
 async def revoke_confirm(callback: types.CallbackQuery):
     await callback.answer()
     user_id = callback.from_user.id
 
     # Delete user data from Supabase
     try:
-        user_flats = supabase.table("users").select("*").eq("telegram_id", user_id).execute()
-        deleted_count = 0
-        if user_flats.data:
-            supabase.table("users").delete().eq("telegram_id", user_id).execute()
-            deleted_count = len(user_flats.data)
+        deleted_count, queued = await delete_user_data(user_id)
     except Exception as e:
-        logging.error(f"Revoke: error deleting user data: {e}")
+        logging.error("Revoke: error deleting user data: %s", e)
         await callback.message.edit_text(
             "Произошла ошибка при удалении данных. Попробуйте позже или обратитесь к разработчику @xmlChay (Илья)"
         )
         return
 
     # Try to remove the user from every connected chat, including the shared one
+    async def remove_from_chat(chat_id: int) -> None:
+        await bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+        await bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
+        membership.index.record_event(chat_id, user_id, "left")
+
+    chat_ids = all_connected_chat_ids()
+    results = await fanout.gather_limited(chat_ids, remove_from_chat, return_exceptions=True)
     removed_from = 0
-    for chat_id in all_connected_chat_ids():
-        try:
-            await bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
-            await bot.unban_chat_member(chat_id=chat_id, user_id=user_id, only_if_banned=True)
-            removed_from += 1
-        except Exception as err:
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
             # Might fail if bot is not admin or user not in the chat; ignore per chat
-            logging.info(f"Revoke: could not remove user {user_id} from chat {chat_id}: {err}")
+            logging.info("Revoke: could not remove user %s from chat %s: %s", user_id, chat_id, result)
             continue
+        removed_from += 1
 
     await callback.message.edit_text(
         (
-            "Ваши данные удалены. "
-            + (f"Удалено записей: {deleted_count}. " if deleted_count else "")
+            ("Ваши данные будут удалены, как только база данных снова станет доступна. " if queued else "Ваши данные удалены. ")
+            + (f"{'Записей к удалению' if queued else 'Удалено записей'}: {deleted_count}. " if deleted_count else "")
             + (
                 f"Вы удалены из {removed_from} чата(ов)."
                 if removed_from
@@ -805,13 +1242,210 @@ async def revoke_confirm(callback: types.CallbackQuery):
         )
     )
 
+def create_bot() -> Bot:
+    global bot
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=TELEGRAM_KEY, session=session)
+    metrics.setup_bot(bot)
+    return bot
+
+
+# Settings the bot cannot start without; everything else only degrades a feature and is just logged
+def validate_config() -> list[str]:
+    problems = []
+    if not TELEGRAM_KEY:
+        problems.append("TELEGRAM_KEY is not set")
+    if not database.url or not database.key:
+        problems.append("SUPABASE_URL and SUPABASE_KEY must be set")
+    chats = registry.current
+    if not chats.connected_chat_ids:
+        logging.warning("No chats are connected; set GROUP_CHAT_IDS or PUBLIC_CHAT_ID")
+    for building in chats.council_chat_ids:
+        if building not in chats.buildings:
+            logging.warning(
+                "COUNCIL_CHAT_IDS mentions building %s, which is not in BUILDINGS or GROUP_CHAT_IDS",
+                building
+            )
+    return problems
+
+
+# Every configured chat must be visible to the bot, otherwise invites and approvals there fail later
+async def validate_chats() -> None:
+    chats = registry.current
+    chat_ids = list(dict.fromkeys([*chats.connected_chat_ids, *chats.council_chat_ids.values()]))
+    results = await fanout.gather_limited(
+        chat_ids,
+        lambda chat_id: bot.get_chat(chat_id=chat_id),
+        return_exceptions=True
+    )
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logging.error("Chat %s from the configuration is not available to the bot: %s", chat_id, result)
+
+
+async def timed_phase(name: str, awaitable):
+    started_at = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        logging.info("Startup: %s took %.0f ms", name, (time.perf_counter() - started_at) * 1000)
+
+
+# Set once the dispatcher is serving updates; until then /readyz keeps traffic away
+started = False
+_readiness: tuple[float, bool, dict] | None = None
+
+
+async def check_readiness() -> tuple[bool, dict]:
+    global _readiness
+    if not started:
+        return False, {"started": False}
+    now = time.monotonic()
+    if _readiness is not None and now - _readiness[0] < READINESS_CACHE_SECONDS:
+        return _readiness[1], _readiness[2]
+
+    async def probe(check) -> str:
+        try:
+            await asyncio.wait_for(check(), READINESS_CHECK_TIMEOUT)
+            return "ok"
+        except Exception as err:
+            logging.warning("Readiness check %s failed: %s", getattr(check, "__name__", check), err)
+            return type(err).__name__
+
+    telegram, db = await asyncio.gather(probe(bot.get_me), probe(database.ping))
+    details = {"started": True, "telegram": telegram, "database": db}
+    # Without the database the bot runs degraded (the outbox takes the writes), so only Telegram decides
+    ready = telegram == "ok"
+    _readiness = (now, ready, details)
+    return ready, details
+
+
+# Counted from the moment the handlers are registered, so the log shows the whole start of the process
+startup_began = time.perf_counter()
+
+
+@dp.startup()
+async def on_startup():
+    global started
+    started = True
+    logging.info("Startup: ready to serve updates after %.0f ms", (time.perf_counter() - startup_began) * 1000)
+
+
+async def serve_webhook():
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logging.info("Serving updates through webhook %s%s on port %s", WEBHOOK_URL, WEBHOOK_PATH, PORT)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await stop.wait()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+# Fire-and-forget tasks; the event loop only keeps weak references, so they are held here until done
+background_tasks: set[asyncio.Task] = set()
+
+
+# Chats added by a config reload get their administrators loaded right away
+def on_chats_reloaded(previous: registry.ChatRegistry, updated: registry.ChatRegistry) -> None:
+    added = [chat_id for chat_id in updated.connected_chat_ids if chat_id not in previous.connected]
+    if added:
+        task = asyncio.create_task(admins.roster.load_all(bot, added))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
 async def main():
+    watchdog = diagnostics.start()
+    chats = registry.current
     logging.info(
         "Effective configuration: buildings=%s, building chats=%s, council chats=%s, public chat=%s, owners=%s",
-        BUILDINGS, GROUP_CHAT_IDS, COUNCIL_CHAT_IDS, PUBLIC_CHAT_ID, sorted(OWNER_IDS)
+        list(chats.buildings), dict(chats.group_chat_ids), dict(chats.council_chat_ids), chats.public_chat_id,
+        sorted(OWNER_IDS)
+    )
+    problems = validate_config()
+    if problems:
+        for problem in problems:
+            logging.critical(problem)
+        raise SystemExit(1)
+
+    started_at = time.perf_counter()
+    create_bot()
+    database.client()
+    logging.info("Startup: clients took %.0f ms", (time.perf_counter() - started_at) * 1000)
+
+    # The port answers right away: /healthz for liveness, /readyz stays 503 until updates are served
+    app = build_app(check_readiness)
+    if WEBHOOK_URL:
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    web_runner = await timed_phase("web server", start_web_server(app, PORT))
+
+    sender.scheduler.start(bot)
+    invite_refill = asyncio.create_task(invites.pool.refill_forever(bot, all_connected_chat_ids))
+    registry.on_reload(on_chats_reloaded)
+    config_watch = asyncio.create_task(registry.watch_forever())
+
+    # Independent warm-ups run side by side; a failed one is logged and the bot starts anyway
+    warm_ups = {
+        "admin rosters": admins.roster.load_all(bot, all_connected_chat_ids()),
+        "chat validation": validate_chats(),
+        "bot identity": bot.me(),
+        "database": database.ping(),
+    }
+    results = await timed_phase(
+        "warm-up",
+        asyncio.gather(*(timed_phase(name, warm_up) for name, warm_up in warm_ups.items()), return_exceptions=True)
     )
-    await dp.start_polling(bot)
+    for name, result in zip(warm_ups, results):
+        if isinstance(result, Exception):
+            logging.error("Startup: %s failed: %s", name, result)
+
+    admin_refresh = asyncio.create_task(admins.roster.refresh_forever(bot, all_connected_chat_ids))
+    reconcile = asyncio.create_task(reconciler.reconciler.run_forever(bot))
+    outbox_replay = asyncio.create_task(outbox.outbox.replay_forever(reevaluate_join_request))
+    replica_sync = asyncio.create_task(
+        replica.replica.sync_forever(lambda after_id: database.iter_registrations(after_id=after_id))
+    )
+    try:
+        if WEBHOOK_URL:
+            await serve_webhook()
+        else:
+            # A webhook left over from a previous deployment would make getUpdates fail
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+        await web_runner.cleanup()
+        admin_refresh.cancel()
+        invite_refill.cancel()
+        config_watch.cancel()
+        reconcile.cancel()
+        outbox_replay.cancel()
+        replica_sync.cancel()
+        await sender.scheduler.stop()
+        logging.info("Send queue stats: %s", sender.scheduler.stats())
+        logging.info("Resident cache stats: %s", database.resident_cache.stats())
+        logging.info("Membership index stats: %s", membership.index.stats())
+        logging.info("Reconciler stats: %s", reconciler.reconciler.stats())
+        logging.info(
+            "Outbox: %s registration(s), %s deletion(s) and %s join request(s) left for the next start",
+            *await outbox.outbox.counts()
+        )
+        await outbox.outbox.close()
 
-keep_alive()
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
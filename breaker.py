@@ -0,0 +1,57 @@
+import time
+
+
+# Closed: calls go through. After `threshold` failures in a row it opens and calls fail at once;
+# once `reset_timeout` has passed a single trial call is let through (half-open), and its outcome
+# either closes the breaker or opens it for another round
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._trial_running or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self._trial_running and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._trial_running = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    # The trial call was cancelled before it could tell anything: the next call becomes the trial
+    def abandon(self) -> None:
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or (self.opened_at is None and self.failures >= self.threshold):
+            if self.opened_at is None:
+                self.opened += 1
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def stats(self) -> dict:
+        return {
+            "open": int(self.state != "closed"),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
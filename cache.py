@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import time
+
+MISSING = object()
+
+
+# In-process cache with a per-entry time to live; the least recently used entry goes first when full
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def discard_if(self, predicate) -> int:
+        stale = [entry_key for entry_key in self._entries if predicate(entry_key)]
+        for entry_key in stale:
+            del self._entries[entry_key]
+        return len(stale)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Tells a read whether its key was invalidated while it was in progress, so that an answer fetched
+# before the change is not cached after it. Only keys with a read in progress are remembered
+class Generations:
+    def __init__(self):
+        self._reads: dict = {}
+
+    def begin(self, key) -> int:
+        entry = self._reads.setdefault(key, [0, 0])
+        entry[0] += 1
+        return entry[1]
+
+    def unchanged(self, key, generation: int) -> bool:
+        entry = self._reads.get(key)
+        return entry is not None and entry[1] == generation
+
+    def end(self, key) -> None:
+        entry = self._reads[key]
+        entry[0] -= 1
+        if not entry[0]:
+            del self._reads[key]
+
+    def bump(self, key) -> None:
+        entry = self._reads.get(key)
+        if entry is not None:
+            entry[1] += 1
@@ -0,0 +1,391 @@
+from concurrent.futures import ThreadPoolExecutor
+from postgrest.exceptions import APIError
+from postgrest.types import CountMethod, ReturnMethod
+from supabase import create_client, Client
+from breaker import CircuitBreaker
+from cache import Generations, TTLCache, MISSING
+from singleflight import SingleFlight
+import asyncio
+import logging
+import os
+import time
+import metrics
+import replica
+from dotenv import load_dotenv
+load_dotenv()
+
+url: str = os.environ.get("SUPABASE_URL")
+key: str = os.environ.get("SUPABASE_KEY")
+_client: Client | None = None
+
+# Seconds a single query may take before the handler stops waiting for it
+DB_TIMEOUT_RAW = os.environ.get("DB_TIMEOUT_SECONDS", "10").strip()
+try:
+    DB_TIMEOUT: float = float(DB_TIMEOUT_RAW)
+except Exception:
+    logging.error("DB_TIMEOUT_SECONDS must be a number of seconds (e.g., 10)")
+    DB_TIMEOUT = 10.0
+
+# Lookups and writes a user is waiting on give up sooner, so the handler can answer right away
+DB_FAST_TIMEOUT_RAW = os.environ.get("DB_FAST_TIMEOUT_SECONDS", "3").strip()
+try:
+    DB_FAST_TIMEOUT: float = min(DB_TIMEOUT, float(DB_FAST_TIMEOUT_RAW))
+except Exception:
+    logging.error("DB_FAST_TIMEOUT_SECONDS must be a number of seconds (e.g., 3)")
+    DB_FAST_TIMEOUT = min(DB_TIMEOUT, 3.0)
+
+# After this many failed queries in a row the database is considered down and queries fail at once
+DB_BREAKER_FAILURES_RAW = os.environ.get("DB_BREAKER_FAILURES", "5").strip()
+try:
+    DB_BREAKER_FAILURES: int = max(1, int(DB_BREAKER_FAILURES_RAW))
+except Exception:
+    logging.error("DB_BREAKER_FAILURES must be a positive integer (e.g., 5)")
+    DB_BREAKER_FAILURES = 5
+
+# How long to wait before a single query checks whether the database is back
+DB_BREAKER_RESET_RAW = os.environ.get("DB_BREAKER_RESET_SECONDS", "30").strip()
+try:
+    DB_BREAKER_RESET: float = float(DB_BREAKER_RESET_RAW)
+except Exception:
+    logging.error("DB_BREAKER_RESET_SECONDS must be a number of seconds (e.g., 30)")
+    DB_BREAKER_RESET = 30.0
+
+# Queries in flight at once; the rest wait for a free slot
+DB_MAX_CONCURRENCY_RAW = os.environ.get("DB_MAX_CONCURRENCY", "8").strip()
+try:
+    DB_MAX_CONCURRENCY: int = max(1, int(DB_MAX_CONCURRENCY_RAW))
+except Exception:
+    logging.error("DB_MAX_CONCURRENCY must be a positive integer (e.g., 8)")
+    DB_MAX_CONCURRENCY = 8
+
+# Registration lookups by (telegram_id, building), building None meaning "any building"
+RESIDENT_CACHE_SIZE_RAW = os.environ.get("RESIDENT_CACHE_SIZE", "10000").strip()
+try:
+    RESIDENT_CACHE_SIZE: int = max(1, int(RESIDENT_CACHE_SIZE_RAW))
+except Exception:
+    logging.error("RESIDENT_CACHE_SIZE must be a positive integer (e.g., 10000)")
+    RESIDENT_CACHE_SIZE = 10000
+
+RESIDENT_CACHE_TTL_RAW = os.environ.get("RESIDENT_CACHE_TTL_SECONDS", "300").strip()
+try:
+    RESIDENT_CACHE_TTL: float = float(RESIDENT_CACHE_TTL_RAW)
+except Exception:
+    logging.error("RESIDENT_CACHE_TTL_SECONDS must be a number of seconds (e.g., 300)")
+    RESIDENT_CACHE_TTL = 300.0
+
+# Misses are kept shorter: a record may still appear through another process or the dashboard
+RESIDENT_CACHE_NEGATIVE_TTL_RAW = os.environ.get("RESIDENT_CACHE_NEGATIVE_TTL_SECONDS", "60").strip()
+try:
+    RESIDENT_CACHE_NEGATIVE_TTL: float = float(RESIDENT_CACHE_NEGATIVE_TTL_RAW)
+except Exception:
+    logging.error("RESIDENT_CACHE_NEGATIVE_TTL_SECONDS must be a number of seconds (e.g., 60)")
+    RESIDENT_CACHE_NEGATIVE_TTL = 60.0
+
+# Residents shown per /flat page; the next ones are behind a button
+FLAT_PAGE_SIZE_RAW = os.environ.get("FLAT_PAGE_SIZE", "20").strip()
+try:
+    FLAT_PAGE_SIZE: int = max(1, int(FLAT_PAGE_SIZE_RAW))
+except Exception:
+    logging.error("FLAT_PAGE_SIZE must be a positive integer (e.g., 20)")
+    FLAT_PAGE_SIZE = 20
+
+# Rows fetched per round trip by /export; only one page is held in memory at a time
+EXPORT_PAGE_SIZE_RAW = os.environ.get("EXPORT_PAGE_SIZE", "500").strip()
+try:
+    EXPORT_PAGE_SIZE: int = max(1, int(EXPORT_PAGE_SIZE_RAW))
+except Exception:
+    logging.error("EXPORT_PAGE_SIZE must be a positive integer (e.g., 500)")
+    EXPORT_PAGE_SIZE = 500
+
+# Only the columns the handlers actually show are sent over the wire
+FLAT_RESIDENT_COLUMNS = "telegram_id,username,first_name,last_name,building"
+EXPORT_COLUMNS = ("id", "building", "flat_number", "telegram_id", "username", "first_name", "last_name", "joined_at")
+
+resident_cache = TTLCache(RESIDENT_CACHE_SIZE, RESIDENT_CACHE_TTL)
+breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+# Identical lookups in flight at once (button mashing, join request followed by chat_member) share one query
+lookups = SingleFlight()
+# Bumped whenever a user's records change, so a lookup that raced the change does not cache the old answer
+generations = Generations()
+
+
+# The database did not answer: timed out, unreachable, or the breaker is open.
+# Errors the database itself reports (constraint violations and the like) are raised as they are
+class DatabaseUnavailable(Exception):
+    pass
+
+
+# Postgres error classes that mean it is going away: connection, resources, shutdown or cancelled statements
+OUTAGE_SQLSTATE_CLASSES = ["08", "53", "57"]
+
+
+# An APIError that is really an outage: PostgREST lost its database (PGRST000-PGRST003), Postgres is going
+# away, or the gateway answered instead of PostgREST. postgrest-py puts the HTTP status in the code only
+# when the body is not PostgREST's JSON, which is also how gateway errors (5xx, 52x) look
+def is_outage(err: APIError) -> bool:
+    code = err.code
+    if isinstance(code, int):
+        return True
+    code = str(code or "")
+    return code.startswith("PGRST00") or code[:2] in OUTAGE_SQLSTATE_CLASSES
+
+# The Supabase client is synchronous: run it on worker threads so the event loop keeps serving updates
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="supabase")
+_slots = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+
+
+async def run_query(name: str, build_query, timeout: float | None = None):
+    timeout = timeout or DB_TIMEOUT
+    if not breaker.allow():
+        metrics.DB_ERRORS.labels(query=name).inc()
+        raise DatabaseUnavailable(f"Supabase query {name} skipped: the database is unavailable")
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(_executor, lambda: build_query().execute()),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            metrics.DB_ERRORS.labels(query=name).inc()
+            breaker.record_failure()
+            # The worker thread finishes the request on its own, only the caller gives up
+            raise DatabaseUnavailable(f"Supabase query {name} timed out after {timeout}s")
+        except APIError as err:
+            metrics.DB_ERRORS.labels(query=name).inc()
+            if is_outage(err):
+                breaker.record_failure()
+                raise DatabaseUnavailable(f"Supabase query {name} failed: {err.code} {err.message}") from err
+            breaker.record_success()
+            raise
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as err:
+            metrics.DB_ERRORS.labels(query=name).inc()
+            breaker.record_failure()
+            raise DatabaseUnavailable(f"Supabase query {name} failed: {err}") from err
+        finally:
+            metrics.DB_SECONDS.labels(query=name).observe(time.perf_counter() - started_at)
+        breaker.record_success()
+        return result
+
+
+# Created on first use rather than at import, so main() decides when the client is set up
+def client() -> Client:
+    global _client
+    if _client is None:
+        _client = create_client(url, key)
+    return _client
+
+
+def users():
+    return client().table("users")
+
+
+# Cheapest query that proves the database answers; used by the readiness probe
+async def ping() -> None:
+    await run_query("ping", lambda: users().select("id").limit(1), DB_FAST_TIMEOUT)
+
+
+def forget_user(telegram_id: int) -> None:
+    generations.bump(telegram_id)
+    resident_cache.discard_if(lambda cache_key: cache_key[0] == telegram_id)
+    lookups.forget_if(lambda flight_key: flight_key[1] == telegram_id)
+
+
+async def find_user_record(telegram_id: int, building: str | None = None) -> bool:
+    cached = resident_cache.get((telegram_id, building))
+    if cached is not MISSING:
+        return cached
+
+    def build():
+        query = users().select("id").eq("telegram_id", telegram_id)
+        if building is not None:
+            query = query.eq("building", building)
+        return query.limit(1)
+
+    async def lookup() -> bool:
+        generation = generations.begin(telegram_id)
+        try:
+            result = await run_query("find_user_record", build, DB_FAST_TIMEOUT)
+            found = bool(result.data)
+            if generations.unchanged(telegram_id, generation):
+                resident_cache.set(
+                    (telegram_id, building),
+                    found,
+                    ttl=None if found else RESIDENT_CACHE_NEGATIVE_TTL
+                )
+            return found
+        finally:
+            generations.end(telegram_id)
+
+    return await lookups.do(("find_user_record", telegram_id, building), lookup)
+
+
+# Buildings each of the given users is registered in, with one query for the whole batch
+async def find_registered_buildings(telegram_ids: list[int]) -> dict[int, set[str]]:
+    started = {telegram_id: generations.begin(telegram_id) for telegram_id in set(telegram_ids)}
+    try:
+        result = await run_query(
+            "find_registered_buildings",
+            lambda: users().select("telegram_id,building").in_("telegram_id", telegram_ids),
+            DB_FAST_TIMEOUT
+        )
+        changed = {
+            telegram_id for telegram_id, generation in started.items()
+            if not generations.unchanged(telegram_id, generation)
+        }
+    finally:
+        for telegram_id in started:
+            generations.end(telegram_id)
+    registered: dict[int, set[str]] = {telegram_id: set() for telegram_id in telegram_ids}
+    for row in result.data or []:
+        registered.setdefault(row["telegram_id"], set()).add(row["building"])
+    for telegram_id, buildings in registered.items():
+        if telegram_id in changed:
+            continue
+        resident_cache.set(
+            (telegram_id, None),
+            bool(buildings),
+            ttl=None if buildings else RESIDENT_CACHE_NEGATIVE_TTL
+        )
+        for building in buildings:
+            resident_cache.set((telegram_id, building), True)
+    return registered
+
+
+# One round trip: the unique key (telegram_id, building, flat_number) turns a repeated flat into a no-op.
+# Returns False when the flat was already registered
+async def register_flat(user_data: dict) -> bool:
+    telegram_id = user_data["telegram_id"]
+    try:
+        result = await run_query(
+            "register_flat",
+            lambda: users().upsert(
+                user_data,
+                on_conflict="telegram_id,building,flat_number",
+                ignore_duplicates=True
+            ).select(",".join(EXPORT_COLUMNS)),
+            DB_FAST_TIMEOUT
+        )
+    except Exception:
+        forget_user(telegram_id)
+        raise
+    # A "not registered" answer fetched before the upsert must not land after it
+    generations.bump(telegram_id)
+    resident_cache.set((telegram_id, user_data["building"]), True)
+    resident_cache.set((telegram_id, None), True)
+    replica.replica.add(result.data or [])
+    return bool(result.data)
+
+
+async def fetch_user_flats(telegram_id: int, building: str | None = None) -> list[dict]:
+    def build():
+        query = users().select("*").eq("telegram_id", telegram_id)
+        if building is not None:
+            query = query.eq("building", building)
+        return query
+
+    async def fetch() -> list[dict]:
+        result = await run_query("fetch_user_flats", build, DB_FAST_TIMEOUT)
+        return result.data or []
+
+    # Callers that joined the same query share the list: copy before changing it
+    return await lookups.do(("fetch_user_flats", telegram_id, building), fetch)
+
+
+# Returns how many flats were removed, counted by the server in the same round trip
+async def delete_user_flats(telegram_id: int, building: str | None = None) -> int:
+    def build():
+        query = users().delete(count=CountMethod.exact, returning=ReturnMethod.minimal).eq("telegram_id", telegram_id)
+        if building is not None:
+            query = query.eq("building", building)
+        return query
+
+    try:
+        result = await run_query("delete_user_flats", build)
+    finally:
+        # Even a failed delete may have gone through on the server
+        forget_user(telegram_id)
+    replica.replica.delete_user(telegram_id, building)
+    return result.count or 0
+
+
+# Removes exactly these rows, not everything of their users: a newer registration stays untouched
+async def delete_registrations(rows: list[dict]) -> int:
+    if not rows:
+        return 0
+    try:
+        result = await run_query(
+            "delete_registrations",
+            lambda: users().delete(count=CountMethod.exact, returning=ReturnMethod.minimal).in_(
+                "id", [row["id"] for row in rows]
+            )
+        )
+    finally:
+        for telegram_id in {row["telegram_id"] for row in rows}:
+            forget_user(telegram_id)
+    replica.replica.delete_ids([row["id"] for row in rows])
+    return result.count or 0
+
+
+# One page of residents, ordered so that pages never overlap; the flag tells whether more follow
+async def fetch_flat_residents(
+    flat_number: str,
+    building: str | None = None,
+    offset: int = 0,
+    limit: int = FLAT_PAGE_SIZE
+) -> tuple[list[dict], bool]:
+    def build():
+        query = users().select(FLAT_RESIDENT_COLUMNS).eq("flat_number", flat_number)
+        if building is not None:
+            query = query.eq("building", building)
+        # One row past the page answers "is there a next page" without a count query
+        return query.order("building").order("id").range(offset, offset + limit)
+
+    result = await run_query("fetch_flat_residents", build, DB_FAST_TIMEOUT)
+    rows = result.data or []
+    return rows[:limit], len(rows) > limit
+
+
+# Every registration of a building (or of all of them), page by page, starting after after_id.
+# Keyset paging on id keeps each page an index range scan, however deep into the table it is
+async def iter_registrations(
+    building: str | None = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+    after_id: int | None = None
+):
+    last_id = after_id
+    while True:
+        def build():
+            query = users().select(",".join(EXPORT_COLUMNS))
+            if building is not None:
+                query = query.eq("building", building)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            return query.order("id").limit(page_size)
+
+        result = await run_query("iter_registrations", build)
+        rows = result.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+# Server-side aggregates (migrations/003_users_stats.sql): a few rows however large the table is.
+# The row with building None covers the whole complex
+async def fetch_building_stats() -> list[dict]:
+    result = await run_query("fetch_building_stats", lambda: client().rpc("users_building_stats"))
+    return result.data or []
+
+
+async def fetch_daily_registrations(days: int, timezone: str) -> list[dict]:
+    result = await run_query(
+        "fetch_daily_registrations",
+        lambda: client().rpc("users_daily_registrations", {"days": days, "tz": timezone})
+    )
+    return result.data or []
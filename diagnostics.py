@@ -0,0 +1,108 @@
+from aiogram import BaseMiddleware
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import metrics
+
+# Opt-in: asyncio debug mode and the watchdog thread cost a little on every callback
+LOOP_DIAGNOSTICS = os.environ.get("LOOP_DIAGNOSTICS", "").strip().lower() in ["1", "true", "yes", "on"]
+
+LOOP_STALL_THRESHOLD_MS_RAW = os.environ.get("LOOP_STALL_THRESHOLD_MS", "250").strip()
+try:
+    LOOP_STALL_THRESHOLD: float = max(1, int(LOOP_STALL_THRESHOLD_MS_RAW)) / 1000
+except Exception:
+    logging.error("LOOP_STALL_THRESHOLD_MS must be a positive integer (e.g., 250)")
+    LOOP_STALL_THRESHOLD = 0.25
+
+# Handler and update each running task is serving; read by the watchdog thread
+running_handlers: dict[asyncio.Task, tuple[str, int | None]] = {}
+
+
+class HandlerTrackingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        task = asyncio.current_task()
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        update = data.get("event_update")
+        running_handlers[task] = (name, getattr(update, "update_id", None))
+        try:
+            return await handler(event, data)
+        finally:
+            running_handlers.pop(task, None)
+
+
+class StallWatchdog:
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float):
+        self.loop = loop
+        self.threshold = threshold
+        self.last_tick = time.monotonic()
+        self.loop_thread_id = threading.get_ident()
+        self.stalled_handler: str | None = None
+        self.heartbeat_task: asyncio.Task | None = None
+        self._stopped = threading.Event()
+
+    # Runs on the loop: every tick proves the loop is free, a late tick is a stall that just ended
+    async def heartbeat(self) -> None:
+        interval = self.threshold / 4
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            stall = now - self.last_tick - interval
+            self.last_tick = now
+            if stall >= self.threshold:
+                handler = self.stalled_handler or "unknown"
+                self.stalled_handler = None
+                metrics.LOOP_STALLS.labels(handler=handler).inc()
+                metrics.LOOP_STALL_SECONDS.labels(handler=handler).observe(stall)
+                logging.warning("Event loop was blocked for %.0f ms (handler: %s)", stall * 1000, handler)
+
+    # Runs on its own thread: while the loop is stuck, find out what it is running
+    def watch(self) -> None:
+        reported_tick = None
+        while not self._stopped.wait(self.threshold / 4):
+            last_tick = self.last_tick
+            if time.monotonic() - last_tick < self.threshold * 1.25 or reported_tick == last_tick:
+                continue
+            reported_tick = last_tick
+            task = asyncio.current_task(self.loop)
+            handler, update_id = running_handlers.get(task, ("unknown", None))
+            self.stalled_handler = handler
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable"
+            logging.warning(
+                "Event loop blocked for over %.0f ms in handler %s (update %s). Stack:\n%s",
+                self.threshold * 1000, handler, update_id, stack
+            )
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+
+def setup(dp) -> None:
+    if not LOOP_DIAGNOSTICS:
+        return
+    for event_name, observer in dp.observers.items():
+        if event_name != "error":
+            observer.middleware(HandlerTrackingMiddleware())
+
+
+# Call from the running loop; returns None when diagnostics are off
+def start() -> StallWatchdog | None:
+    if not LOOP_DIAGNOSTICS:
+        return None
+    loop = asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = LOOP_STALL_THRESHOLD
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    watchdog = StallWatchdog(loop, LOOP_STALL_THRESHOLD)
+    threading.Thread(target=watchdog.watch, name="loop-watchdog", daemon=True).start()
+    watchdog.heartbeat_task = asyncio.create_task(watchdog.heartbeat())
+    logging.info("Event loop diagnostics enabled, stall threshold %.0f ms", LOOP_STALL_THRESHOLD * 1000)
+    return watchdog
@@ -0,0 +1,95 @@
+from aiogram.methods import SendMessage
+import asyncio
+import json
+import logging
+import os
+import time
+import sender
+
+# A chat gets at most one join post per window: a join in a quiet chat is posted at once,
+# joins that follow within the window are collected and posted together when it ends
+JOIN_DIGEST_WINDOW_RAW = os.environ.get("JOIN_DIGEST_WINDOW_SECONDS", "60").strip()
+try:
+    JOIN_DIGEST_WINDOW: float = max(0.0, float(JOIN_DIGEST_WINDOW_RAW))
+except Exception:
+    logging.error("JOIN_DIGEST_WINDOW_SECONDS must be a number of seconds (e.g., 60), 0 to post every join")
+    JOIN_DIGEST_WINDOW = 60.0
+
+# Per-chat windows, JSON: {"-1001234567890": 300}; building and council chats alike
+JOIN_DIGEST_WINDOWS_RAW = os.environ.get("JOIN_DIGEST_WINDOWS", "").strip()
+try:
+    JOIN_DIGEST_WINDOWS: dict[int, float] = {
+        int(chat_id): max(0.0, float(window))
+        for chat_id, window in (json.loads(JOIN_DIGEST_WINDOWS_RAW) if JOIN_DIGEST_WINDOWS_RAW else {}).items()
+    }
+except Exception:
+    logging.error('JOIN_DIGEST_WINDOWS must be JSON mapping chat ids to seconds (e.g., {"-1001234567890": 300})')
+    JOIN_DIGEST_WINDOWS = {}
+
+
+class Buffer:
+    def __init__(self, render, priority: int, on_error):
+        self.render = render
+        self.priority = priority
+        self.on_error = on_error
+        self.items: list = []
+        self.last_posted = 0.0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class JoinDigest:
+    def __init__(self, window: float, windows: dict[int, float]):
+        self.window = window
+        self.windows = windows
+        self._buffers: dict[tuple[int, str], Buffer] = {}
+        self.joins = 0
+        self.posts = 0
+
+    def window_for(self, chat_id: int) -> float:
+        return self.windows.get(chat_id, self.window)
+
+    # render(items) returns the messages to post for the collected items, in order.
+    # kind keeps unrelated posts to the same chat apart, e.g. welcomes and council notices
+    def add(self, chat_id: int, kind: str, item, render, priority: int = sender.NORMAL, on_error=None) -> None:
+        self.joins += 1
+        buffer = self._buffers.get((chat_id, kind))
+        if buffer is None:
+            buffer = self._buffers[(chat_id, kind)] = Buffer(render, priority, on_error)
+        buffer.items.append(item)
+        if buffer.timer is not None:
+            return
+        wait = buffer.last_posted + self.window_for(chat_id) - time.monotonic()
+        if wait <= 0:
+            self._post(chat_id, kind)
+        else:
+            buffer.timer = asyncio.get_running_loop().call_later(wait, self._post, chat_id, kind)
+
+    def _post(self, chat_id: int, kind: str) -> None:
+        buffer = self._buffers[(chat_id, kind)]
+        buffer.timer = None
+        items, buffer.items = buffer.items, []
+        if not items:
+            return
+        buffer.last_posted = time.monotonic()
+        try:
+            texts = buffer.render(items)
+        except Exception as err:
+            logging.error("Join digest for chat %s could not be rendered: %s", chat_id, err)
+            return
+        for text in texts:
+            self.posts += 1
+            sender.scheduler.submit(
+                SendMessage(chat_id=chat_id, text=text),
+                priority=buffer.priority,
+                on_error=buffer.on_error
+            )
+
+    def stats(self) -> dict:
+        return {
+            "joins": self.joins,
+            "posts": self.posts,
+            "pending": sum(len(buffer.items) for buffer in self._buffers.values()),
+        }
+
+
+digest = JoinDigest(JOIN_DIGEST_WINDOW, JOIN_DIGEST_WINDOWS)
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import os
+import logs
+
+# Per-chat calls of a single event that may run at the same time
+FANOUT_CONCURRENCY_RAW = os.environ.get("FANOUT_CONCURRENCY", "5").strip()
+try:
+    FANOUT_CONCURRENCY: int = max(1, int(FANOUT_CONCURRENCY_RAW))
+except Exception:
+    logging.error("FANOUT_CONCURRENCY must be a positive integer (e.g., 5)")
+    FANOUT_CONCURRENCY = 5
+
+
+# Like asyncio.gather over func(item) for every item, with at most `limit` calls in flight
+async def gather_limited(items, func, limit: int | None = None, return_exceptions: bool = False) -> list:
+    slots = asyncio.Semaphore(limit or FANOUT_CONCURRENCY)
+
+    async def run(item):
+        async with slots:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=return_exceptions)
+
+
+# First item whose predicate holds, or None; the checks still running are cancelled once it is found
+async def find_first(items, predicate, limit: int | None = None):
+    slots = asyncio.Semaphore(limit or FANOUT_CONCURRENCY)
+
+    async def check(item):
+        async with slots:
+            try:
+                return item, await predicate(item)
+            except Exception as err:
+                logging.info("Check failed for %s: %s", item, err, extra=logs.SAMPLED)
+                return item, False
+
+    tasks = [asyncio.create_task(check(item)) for item in items]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            item, matched = await finished
+            if matched:
+                return item
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,117 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlite_worker import SQLiteWorker
+import json
+import logging
+import os
+import sqlite3
+import time
+
+# Where JoinChat conversations live:
+#   memory (default)          — this process only, lost on restart
+#   sqlite:///fsm.db          — shared by the processes on one host, survives restarts
+#   redis://host:6379/0       — shared by processes anywhere; needs the redis package
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "memory").strip()
+
+# Abandoned sign-ups are forgotten after this long
+FSM_TTL_RAW = os.environ.get("FSM_TTL_SECONDS", "86400").strip()
+try:
+    FSM_TTL: int = max(1, int(FSM_TTL_RAW))
+except Exception:
+    logging.error("FSM_TTL_SECONDS must be a positive integer (e.g., 86400)")
+    FSM_TTL = 86400
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str, ttl: int = FSM_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._db = SQLiteWorker(path, "fsm", [
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)",
+        ])
+        self._last_purge = 0.0
+
+    def _read(self, connection: sqlite3.Connection, key: str) -> tuple[str | None, dict]:
+        row = connection.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, connection: sqlite3.Connection, key: str, state: str | None, data: dict) -> None:
+        now = time.time()
+        if state is None and not data:
+            connection.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            connection.execute(
+                "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "expires_at = excluded.expires_at",
+                (key, state, json.dumps(data, ensure_ascii=False), now + self.ttl)
+            )
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            connection.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,))
+
+    def _update(self, connection: sqlite3.Connection, key: str, change) -> dict:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            state, data = self._read(connection, key)
+            state, data = change(state, data)
+            self._write(connection, key, state, data)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return data
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._db.run(self._update, self.key_builder.build(key), lambda _, data: (value, data))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._db.run(self._read, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        new_data = dict(data)
+        await self._db.run(self._update, self.key_builder.build(key), lambda state, _: (state, new_data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, data = await self._db.run(self._read, self.key_builder.build(key))
+        return data
+
+    # Read and write in one transaction, so two processes cannot lose each other's changes
+    async def update_data(self, key: StorageKey, data) -> dict:
+        changes = dict(data)
+        return await self._db.run(
+            self._update,
+            self.key_builder.build(key),
+            lambda state, current: (state, {**current, **changes})
+        )
+
+    async def close(self) -> None:
+        await self._db.close()
+
+
+def create_storage(spec: str = FSM_STORAGE) -> BaseStorage:
+    if spec.startswith("sqlite:"):
+        # Same form as SQLAlchemy URLs: three slashes for a relative path, four for an absolute one
+        path = spec.removeprefix("sqlite:").removeprefix("//").removeprefix("/")
+        return SQLiteStorage(path or "fsm.db")
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+            return RedisStorage.from_url(spec, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+        except ImportError:
+            logging.error("FSM_STORAGE points to Redis, but the redis package is not installed; using memory storage")
+            return MemoryStorage()
+    if spec and spec != "memory":
+        logging.error("FSM_STORAGE must be memory, sqlite:///path/to/fsm.db or redis://host:port/db; using memory storage")
+    return MemoryStorage()
@@ -0,0 +1,127 @@
+from aiogram import Bot
+from collections import deque
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+# Ready-made one-time links kept per chat: refilled up to HIGH, urgently once at or below LOW
+INVITE_POOL_LOW_RAW = os.environ.get("INVITE_POOL_LOW", "3").strip()
+try:
+    INVITE_POOL_LOW: int = max(0, int(INVITE_POOL_LOW_RAW))
+except Exception:
+    logging.error("INVITE_POOL_LOW must be a non-negative integer (e.g., 3)")
+    INVITE_POOL_LOW = 3
+
+INVITE_POOL_HIGH_RAW = os.environ.get("INVITE_POOL_HIGH", "10").strip()
+try:
+    INVITE_POOL_HIGH: int = max(INVITE_POOL_LOW + 1, int(INVITE_POOL_HIGH_RAW))
+except Exception:
+    logging.error("INVITE_POOL_HIGH must be an integer above INVITE_POOL_LOW (e.g., 10)")
+    INVITE_POOL_HIGH = INVITE_POOL_LOW + 7
+
+# Pooled links expire on their own, so the ones nobody took do not pile up in the chat settings
+INVITE_LINK_LIFETIME_HOURS_RAW = os.environ.get("INVITE_LINK_LIFETIME_HOURS", "168").strip()
+try:
+    INVITE_LINK_LIFETIME: float = float(INVITE_LINK_LIFETIME_HOURS_RAW) * 3600
+except Exception:
+    logging.error("INVITE_LINK_LIFETIME_HOURS must be a number of hours (e.g., 168)")
+    INVITE_LINK_LIFETIME = 168 * 3600
+
+# A link is only handed out while the user still has this long to use it; older ones are rotated out
+INVITE_LINK_MIN_REMAINING_HOURS_RAW = os.environ.get("INVITE_LINK_MIN_REMAINING_HOURS", "24").strip()
+try:
+    INVITE_LINK_MIN_REMAINING: float = float(INVITE_LINK_MIN_REMAINING_HOURS_RAW) * 3600
+except Exception:
+    logging.error("INVITE_LINK_MIN_REMAINING_HOURS must be a number of hours (e.g., 24)")
+    INVITE_LINK_MIN_REMAINING = 24 * 3600
+# Otherwise every link would be rotated out as soon as it is created and none would ever be handed out
+if INVITE_LINK_MIN_REMAINING >= INVITE_LINK_LIFETIME:
+    logging.error("INVITE_LINK_MIN_REMAINING_HOURS must be below INVITE_LINK_LIFETIME_HOURS (e.g., 24 and 168)")
+    INVITE_LINK_MIN_REMAINING = INVITE_LINK_LIFETIME / 2
+
+# Pause between two links created for the pool, so refills never arrive as a burst
+INVITE_POOL_CREATE_INTERVAL = 1.0
+INVITE_POOL_CHECK_INTERVAL = 60.0
+
+
+class InviteLinkPool:
+    def __init__(self, low: int, high: int, lifetime: float, min_remaining: float):
+        self.low = low
+        self.high = high
+        self.lifetime = lifetime
+        self.min_remaining = min_remaining
+        self._links: dict[int, deque[tuple[str, float]]] = {}
+        self._wakeup = asyncio.Event()
+        self.taken = 0
+        self.missed = 0
+        self.created = 0
+        self.rotated = 0
+
+    def _rotate(self, chat_id: int) -> deque:
+        links = self._links.setdefault(chat_id, deque())
+        usable_after = time.time() + self.min_remaining
+        # Links are created in order, so the ones about to expire are always at the front
+        while links and links[0][1] <= usable_after:
+            links.popleft()
+            self.rotated += 1
+        return links
+
+    # A pooled link leaves the pool for good: nobody else can get it
+    def take(self, chat_id: int) -> str | None:
+        links = self._rotate(chat_id)
+        if len(links) <= self.low + 1:
+            self._wakeup.set()
+        if not links:
+            self.missed += 1
+            return None
+        self.taken += 1
+        return links.popleft()[0]
+
+    async def create(self, bot: Bot, chat_id: int) -> tuple[str, float]:
+        expires_at = time.time() + self.lifetime
+        invite = await bot.create_chat_invite_link(
+            chat_id=chat_id,
+            member_limit=1,
+            expire_date=datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc)
+        )
+        return invite.invite_link, expires_at
+
+    async def refill(self, bot: Bot, chat_id: int, target: int) -> None:
+        links = self._rotate(chat_id)
+        while len(links) < target:
+            try:
+                links.append(await self.create(bot, chat_id))
+                self.created += 1
+            except Exception as err:
+                logging.error("Error creating pooled invite link for chat %s: %s", chat_id, err)
+                return
+            await asyncio.sleep(INVITE_POOL_CREATE_INTERVAL)
+
+    async def refill_forever(self, bot: Bot, get_chat_ids) -> None:
+        while True:
+            self._wakeup.clear()
+            for chat_id in get_chat_ids():
+                links = self._rotate(chat_id)
+                # Below the low watermark the pool is filled right away, otherwise topped up one link per round
+                if len(links) <= self.low:
+                    await self.refill(bot, chat_id, self.high)
+                elif len(links) < self.high:
+                    await self.refill(bot, chat_id, len(links) + 1)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=INVITE_POOL_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "pooled": sum(len(links) for links in self._links.values()),
+            "taken": self.taken,
+            "missed": self.missed,
+            "created": self.created,
+            "rotated": self.rotated,
+        }
+
+
+pool = InviteLinkPool(INVITE_POOL_LOW, INVITE_POOL_HIGH, INVITE_LINK_LIFETIME, INVITE_LINK_MIN_REMAINING)
@@ -0,0 +1,82 @@
+from cache import MISSING
+import asyncio
+import database
+import logging
+import os
+
+# How long a join request waits for others to share its database query; keep it well under a second
+JOIN_BATCH_WINDOW_MS_RAW = os.environ.get("JOIN_BATCH_WINDOW_MS", "200").strip()
+try:
+    JOIN_BATCH_WINDOW: float = max(0, int(JOIN_BATCH_WINDOW_MS_RAW)) / 1000
+except Exception:
+    logging.error("JOIN_BATCH_WINDOW_MS must be a non-negative integer (e.g., 200)")
+    JOIN_BATCH_WINDOW = 0.2
+
+# A full batch is looked up right away, without waiting for the window to close
+JOIN_BATCH_MAX_RAW = os.environ.get("JOIN_BATCH_MAX", "100").strip()
+try:
+    JOIN_BATCH_MAX: int = max(1, int(JOIN_BATCH_MAX_RAW))
+except Exception:
+    logging.error("JOIN_BATCH_MAX must be a positive integer (e.g., 100)")
+    JOIN_BATCH_MAX = 100
+
+# Batch lookups in progress; the event loop only keeps weak references to tasks
+_lookups: set[asyncio.Task] = set()
+
+
+# Collects registration checks of join requests and answers them with one in_("telegram_id", ...) query
+class JoinRequestBatcher:
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: list[tuple[int, str | None, asyncio.Future]] = []
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self.batches = 0
+        self.batched_requests = 0
+
+    # Same answer as database.find_user_record(telegram_id, building), raises if the lookup failed
+    async def has_record(self, telegram_id: int, building: str | None) -> bool:
+        cached = database.resident_cache.get((telegram_id, building))
+        if cached is not MISSING:
+            return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((telegram_id, building, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._resolve(batch))
+            _lookups.add(task)
+            task.add_done_callback(_lookups.discard)
+
+    async def _resolve(self, batch: list[tuple[int, str | None, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.batched_requests += len(batch)
+        try:
+            registered = await database.find_registered_buildings(
+                list(dict.fromkeys(telegram_id for telegram_id, _, _ in batch))
+            )
+        except Exception as err:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for telegram_id, building, future in batch:
+            buildings = registered.get(telegram_id, set())
+            if not future.done():
+                future.set_result(bool(buildings) if building is None else building in buildings)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "batched_requests": self.batched_requests}
+
+
+batcher = JoinRequestBatcher(JOIN_BATCH_WINDOW, JOIN_BATCH_MAX)
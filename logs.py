@@ -0,0 +1,206 @@
+from aiogram import BaseMiddleware
+from contextvars import ContextVar
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# json (default) — one object per line for the log collector; text — human-readable, for local runs
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").strip().lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
+
+# Records waiting for the writer thread; beyond this they are dropped rather than slowing handlers down
+LOG_QUEUE_SIZE_RAW = os.environ.get("LOG_QUEUE_SIZE", "10000").strip()
+try:
+    LOG_QUEUE_SIZE: int = max(1, int(LOG_QUEUE_SIZE_RAW))
+except Exception:
+    logging.error("LOG_QUEUE_SIZE must be a positive integer (e.g., 10000)")
+    LOG_QUEUE_SIZE = 10000
+
+# Sampled lines: at most LOG_SAMPLE_BURST of each message per LOG_SAMPLE_INTERVAL_SECONDS
+LOG_SAMPLE_BURST_RAW = os.environ.get("LOG_SAMPLE_BURST", "5").strip()
+try:
+    LOG_SAMPLE_BURST: int = max(1, int(LOG_SAMPLE_BURST_RAW))
+except Exception:
+    logging.error("LOG_SAMPLE_BURST must be a positive integer (e.g., 5)")
+    LOG_SAMPLE_BURST = 5
+
+LOG_SAMPLE_INTERVAL_RAW = os.environ.get("LOG_SAMPLE_INTERVAL_SECONDS", "60").strip()
+try:
+    LOG_SAMPLE_INTERVAL: float = float(LOG_SAMPLE_INTERVAL_RAW)
+except Exception:
+    logging.error("LOG_SAMPLE_INTERVAL_SECONDS must be a number of seconds (e.g., 60)")
+    LOG_SAMPLE_INTERVAL = 60.0
+
+# Pass as extra= on noisy lines; the message template is the sampling key
+SAMPLED = {"sampled": True}
+
+# The update being handled by the current task; copied onto every record it logs
+update_id_var: ContextVar[int | None] = ContextVar("update_id", default=None)
+chat_id_var: ContextVar[int | None] = ContextVar("chat_id", default=None)
+handler_var: ContextVar[str | None] = ContextVar("handler", default=None)
+started_at_var: ContextVar[float | None] = ContextVar("started_at", default=None)
+
+CONTEXT_FIELDS = ("update_id", "chat_id", "handler", "latency_ms", "suppressed")
+
+
+class LogContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        chat = data.get("event_chat")
+        tokens = [
+            update_id_var.set(getattr(event, "update_id", None)),
+            chat_id_var.set(chat.id if chat is not None else None),
+            started_at_var.set(time.perf_counter()),
+        ]
+        try:
+            return await handler(event, data)
+        finally:
+            for token in reversed(tokens):
+                token.var.reset(token)
+
+
+class HandlerContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        token = handler_var.set(getattr(getattr(data.get("handler"), "callback", None), "__name__", None))
+        try:
+            return await handler(event, data)
+        finally:
+            handler_var.reset(token)
+
+
+# Runs in the thread that logs, where the context variables of the update are still visible
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.chat_id = chat_id_var.get()
+        record.handler = handler_var.get()
+        started_at = started_at_var.get()
+        record.latency_ms = round((time.perf_counter() - started_at) * 1000, 1) if started_at is not None else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        key = f"{record.name}:{record.msg}"
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) >= 1000:
+                    self._windows.clear()
+                # How many were skipped in the previous window is reported on the first line of the next one
+                record.suppressed = window[2] if window is not None and window[2] else None
+                self._windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            self.suppressed += 1
+            return False
+
+
+# Leaves formatting to the writer thread: the handler only puts the record on the queue.
+# Arguments are rendered later, so log values, not objects that are about to change
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = " ".join(
+            f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None) is not None
+        )
+        text = super().format(record)
+        return f"{text} [{context}]" if context else text
+
+
+_handler: DeferredQueueHandler | None = None
+_sampler = SamplingFilter(LOG_SAMPLE_BURST, LOG_SAMPLE_INTERVAL)
+
+
+# Replaces basicConfig: the event loop only enqueues records, a background thread formats and writes them
+def configure() -> None:
+    global _handler
+    if _handler is not None:
+        return
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _handler = DeferredQueueHandler(log_queue)
+    _handler.addFilter(_sampler)
+    _handler.addFilter(ContextFilter())
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    level = logging.getLevelName(LOG_LEVEL)
+    root.setLevel(level if isinstance(level, int) else logging.INFO)
+    listener.start()
+    # Whatever is still queued is written out before the process exits
+    atexit.register(listener.stop)
+
+
+def setup(dp) -> None:
+    dp.update.outer_middleware(LogContextMiddleware())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ["error", "update"]:
+            observer.middleware(HandlerContextMiddleware())
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "suppressed": _sampler.suppressed,
+    }
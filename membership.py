@@ -0,0 +1,87 @@
+from aiogram import Bot
+from cache import Generations, TTLCache, MISSING
+from singleflight import SingleFlight
+import logging
+import os
+
+# Statuses looked up through the Bot API are trusted for this long
+MEMBERSHIP_TTL_RAW = os.environ.get("MEMBERSHIP_TTL_SECONDS", "300").strip()
+try:
+    MEMBERSHIP_TTL: float = float(MEMBERSHIP_TTL_RAW)
+except Exception:
+    logging.error("MEMBERSHIP_TTL_SECONDS must be a number of seconds (e.g., 300)")
+    MEMBERSHIP_TTL = 300.0
+
+# Statuses from chat_member updates are authoritative, but an update can still be missed
+MEMBERSHIP_EVENT_TTL_RAW = os.environ.get("MEMBERSHIP_EVENT_TTL_SECONDS", "3600").strip()
+try:
+    MEMBERSHIP_EVENT_TTL: float = float(MEMBERSHIP_EVENT_TTL_RAW)
+except Exception:
+    logging.error("MEMBERSHIP_EVENT_TTL_SECONDS must be a number of seconds (e.g., 3600)")
+    MEMBERSHIP_EVENT_TTL = 3600.0
+
+# Users remembered per chat; the least recently checked ones are dropped first
+MEMBERSHIP_CACHE_SIZE_RAW = os.environ.get("MEMBERSHIP_CACHE_SIZE", "5000").strip()
+try:
+    MEMBERSHIP_CACHE_SIZE: int = max(1, int(MEMBERSHIP_CACHE_SIZE_RAW))
+except Exception:
+    logging.error("MEMBERSHIP_CACHE_SIZE must be a positive integer (e.g., 5000)")
+    MEMBERSHIP_CACHE_SIZE = 5000
+
+
+# chat_id → user_id → status, fed by chat_member updates and by Bot API lookups
+class MembershipIndex:
+    def __init__(self, maxsize: int, ttl: float, event_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.event_ttl = event_ttl
+        self._chats: dict[int, TTLCache] = {}
+        # A join request and the chat_member update after it often ask about the same user at once
+        self._flights = SingleFlight()
+        # A chat_member update that lands during a lookup wins over the lookup's older answer
+        self._generations = Generations()
+        self.api_calls = 0
+
+    def _chat(self, chat_id: int) -> TTLCache:
+        members = self._chats.get(chat_id)
+        if members is None:
+            members = self._chats[chat_id] = TTLCache(self.maxsize, self.ttl)
+        return members
+
+    def record_event(self, chat_id: int, user_id: int, status: str) -> None:
+        self._chat(chat_id).set(user_id, status, ttl=self.event_ttl)
+        self._generations.bump((chat_id, user_id))
+        self._flights.forget((chat_id, user_id))
+
+    def lookup(self, chat_id: int, user_id: int):
+        return self._chat(chat_id).get(user_id)
+
+    async def get_status(self, bot: Bot, chat_id: int, user_id: int) -> str | None:
+        status = self.lookup(chat_id, user_id)
+        if status is not MISSING:
+            return status
+        return await self._flights.do((chat_id, user_id), lambda: self._fetch_status(bot, chat_id, user_id))
+
+    async def _fetch_status(self, bot: Bot, chat_id: int, user_id: int) -> str | None:
+        # Errors are not cached: the next check asks Telegram again
+        self.api_calls += 1
+        generation = self._generations.begin((chat_id, user_id))
+        try:
+            member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+            status = getattr(member, "status", None)
+            if self._generations.unchanged((chat_id, user_id), generation):
+                self._chat(chat_id).set(user_id, status)
+            return status
+        finally:
+            self._generations.end((chat_id, user_id))
+
+    def stats(self) -> dict:
+        totals = {"chats": len(self._chats), "api_calls": self.api_calls, "coalesced": self._flights.coalesced}
+        for members in self._chats.values():
+            for name, value in members.stats().items():
+                if name != "maxsize":
+                    totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+index = MembershipIndex(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_TTL, MEMBERSHIP_EVENT_TTL)
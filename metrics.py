@@ -0,0 +1,85 @@
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+import time
+
+UPDATES = Counter("bot_updates_total", "Updates received, by update type", ["update_type"])
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in a handler", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", ["handler"])
+DB_SECONDS = Histogram("supabase_query_seconds", "Supabase query latency, by query", ["query"])
+DB_ERRORS = Counter("supabase_query_errors_total", "Failed Supabase queries, by query", ["query"])
+API_SECONDS = Histogram("telegram_api_seconds", "Bot API call latency, by method", ["method"])
+API_ERRORS = Counter("telegram_api_errors_total", "Failed Bot API calls, by method", ["method"])
+LOOP_STALLS = Counter("bot_loop_stalls_total", "Event loop stalls longer than the threshold", ["handler"])
+LOOP_STALL_SECONDS = Histogram(
+    "bot_loop_stall_seconds",
+    "Duration of event loop stalls",
+    ["handler"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 30, 60)
+)
+
+
+# Outer middleware on dp.update: counts every update before routing
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        UPDATES.labels(update_type=event.event_type).inc()
+        return await handler(event, data)
+
+
+# Inner middleware on each event observer: by then the handler that will run is known
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(handler=name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(handler=name).observe(time.perf_counter() - started_at)
+
+
+# Session middleware: wraps every request the Bot makes, including get_chat_member and create_chat_invite_link
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started_at = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            API_ERRORS.labels(method=name).inc()
+            raise
+        finally:
+            API_SECONDS.labels(method=name).observe(time.perf_counter() - started_at)
+
+
+# Counters kept by the caches and queues themselves, read at scrape time
+class StatsCollector:
+    def __init__(self):
+        self._sources = {}
+
+    def add(self, name: str, stats) -> None:
+        self._sources[name] = stats
+
+    def collect(self):
+        for name, stats in self._sources.items():
+            for key, value in stats().items():
+                yield GaugeMetricFamily(f"bot_{name}_{key}", f"{name}: {key}", value=value)
+
+
+stats = StatsCollector()
+REGISTRY.register(stats)
+
+
+def setup(dp) -> None:
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for event_name, observer in dp.observers.items():
+        if event_name != "error":
+            observer.middleware(HandlerMetricsMiddleware())
+
+
+def setup_bot(bot) -> None:
+    bot.session.middleware(ApiMetricsMiddleware())
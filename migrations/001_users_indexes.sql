@@ -0,0 +1,20 @@
+-- Indexes behind the single-round-trip writes in database.py.
+-- Run once in the Supabase SQL editor (or with psql) before deploying the matching bot version.
+
+-- Older versions could store the same flat twice; keep the earliest row of each duplicate group
+delete from public.users newer
+using public.users older
+where newer.telegram_id = older.telegram_id
+  and newer.building = older.building
+  and newer.flat_number = older.flat_number
+  and newer.id > older.id;
+
+-- register_flat upserts with on_conflict=telegram_id,building,flat_number and needs this key.
+-- Its leading column also serves every lookup and delete by telegram_id (membership checks,
+-- leaving a chat, /revoke), so telegram_id does not need an index of its own
+create unique index if not exists users_telegram_id_building_flat_number_key
+  on public.users (telegram_id, building, flat_number);
+
+-- /flat looks residents up by flat number, optionally within a building
+create index if not exists users_building_flat_number_idx
+  on public.users (building, flat_number);
@@ -0,0 +1,7 @@
+-- Index behind /export in database.py (iter_registrations).
+-- Run once in the Supabase SQL editor (or with psql) before deploying the matching bot version.
+
+-- /export pages through one building by id (where building = ? and id > ? order by id limit ?),
+-- so every page is a short range scan instead of a sort of the whole building
+create index if not exists users_building_id_idx
+  on public.users (building, id);
@@ -0,0 +1,34 @@
+-- Aggregates behind /stats in database.py (fetch_building_stats, fetch_daily_registrations).
+-- Run once in the Supabase SQL editor (or with psql) before deploying the matching bot version.
+-- Both functions return a handful of rows, so answering /stats never transfers the table itself
+
+-- Flats, residents and records per building, plus one row with building = null for the whole complex.
+-- Flats are counted per building: flat 12 of two buildings is two flats
+create or replace function public.users_building_stats()
+returns table (building text, flats bigint, residents bigint, registrations bigint)
+language sql stable
+as $$
+  select building,
+         count(distinct (building, flat_number)),
+         count(distinct telegram_id),
+         count(*)
+  from public.users
+  group by grouping sets ((building), ())
+  order by building nulls last
+$$;
+
+-- New records per day and building over the last `days` days, days counted in time zone `tz`
+create or replace function public.users_daily_registrations(days integer default 14, tz text default 'UTC')
+returns table (day date, building text, registrations bigint)
+language sql stable
+as $$
+  select (joined_at at time zone tz)::date, building, count(*)
+  from public.users
+  where joined_at >= date_trunc('day', now() at time zone tz) at time zone tz - make_interval(days => days - 1)
+  group by 1, 2
+  order by 1, 2
+$$;
+
+-- The per-day counts read only the recent end of the table
+create index if not exists users_joined_at_idx
+  on public.users (joined_at);
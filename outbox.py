@@ -0,0 +1,184 @@
+from sqlite_worker import SQLiteWorker
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+import database
+
+# Local store for work that needs the database while it is down: registrations to write, data to
+# delete and join requests to decide. Kept on disk, so a restart during an outage loses none of them
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "outbox.db").strip()
+
+OUTBOX_RETRY_RAW = os.environ.get("OUTBOX_RETRY_SECONDS", "15").strip()
+try:
+    OUTBOX_RETRY: float = max(1.0, float(OUTBOX_RETRY_RAW))
+except Exception:
+    logging.error("OUTBOX_RETRY_SECONDS must be a number of seconds (e.g., 15)")
+    OUTBOX_RETRY = 15.0
+
+
+class Outbox:
+    def __init__(self, path: str):
+        self.path = path
+        # Queued work must survive a power loss too, so every write is synced to disk
+        self._db = SQLiteWorker(path, "outbox", [
+            "CREATE TABLE IF NOT EXISTS registrations ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER NOT NULL, building TEXT NOT NULL, "
+            "payload TEXT NOT NULL, queued_at REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS join_requests ("
+            "chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, user_name TEXT NOT NULL, building TEXT, "
+            "parked_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, user_id))",
+            # building NULL deletes every registration of the user
+            "CREATE TABLE IF NOT EXISTS deletions ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER NOT NULL, building TEXT, queued_at REAL NOT NULL)",
+        ], synchronous="FULL")
+        self.queued = 0
+        self.parked = 0
+        self.deletions_queued = 0
+        self.replayed = 0
+        self.deleted = 0
+        self.reevaluated = 0
+
+    async def add_registration(self, user_data: dict) -> None:
+        # The user registered now, not whenever the replay gets through
+        payload = {**user_data, "joined_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+        await self._db.run(
+            lambda connection: connection.execute(
+                "INSERT INTO registrations (telegram_id, building, payload, queued_at) VALUES (?, ?, ?, ?)",
+                (user_data["telegram_id"], user_data["building"], json.dumps(payload, ensure_ascii=False), time.time())
+            )
+        )
+        self.queued += 1
+
+    # Data of a user who left or revoked consent while the database was down; building None means all of it
+    async def add_deletion(self, telegram_id: int, building: str | None = None) -> None:
+        await self._db.run(
+            lambda connection: connection.execute(
+                "INSERT INTO deletions (telegram_id, building, queued_at) VALUES (?, ?, ?)",
+                (telegram_id, building, time.time())
+            )
+        )
+        self.deletions_queued += 1
+
+    # Buildings the user registered in while the database was down
+    async def pending_buildings(self, telegram_id: int) -> set[str]:
+        rows = await self._db.run(
+            lambda connection: connection.execute(
+                "SELECT DISTINCT building FROM registrations WHERE telegram_id = ?", (telegram_id,)
+            ).fetchall()
+        )
+        return {row[0] for row in rows}
+
+    # A user who revoked consent or left must not be written back by a later replay
+    async def forget_user(self, telegram_id: int, building: str | None = None) -> int:
+        def delete(connection):
+            if building is None:
+                cursor = connection.execute("DELETE FROM registrations WHERE telegram_id = ?", (telegram_id,))
+            else:
+                cursor = connection.execute(
+                    "DELETE FROM registrations WHERE telegram_id = ? AND building = ?", (telegram_id, building)
+                )
+            return cursor.rowcount
+
+        return await self._db.run(delete)
+
+    async def park_join_request(self, chat_id: int, user_id: int, user_name: str, building: str | None) -> None:
+        await self._db.run(
+            lambda connection: connection.execute(
+                "INSERT OR REPLACE INTO join_requests (chat_id, user_id, user_name, building, parked_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chat_id, user_id, user_name, building, time.time())
+            )
+        )
+        self.parked += 1
+
+    # Writes the queued registrations in order; stops at the first one that finds the database down
+    async def replay_registrations(self) -> None:
+        queued = await self._db.run(
+            lambda connection: connection.execute("SELECT id, payload FROM registrations ORDER BY id").fetchall()
+        )
+        for row_id, payload in queued:
+            try:
+                await database.register_flat(json.loads(payload))
+            except database.DatabaseUnavailable:
+                raise
+            except Exception as err:
+                # Rejected by the database itself: retrying will not change the answer
+                logging.error("Outbox: dropped queued registration %s: %s", payload, err)
+            await self._db.run(lambda connection: connection.execute("DELETE FROM registrations WHERE id = ?", (row_id,)))
+            self.replayed += 1
+
+    # Same order and error handling as the registrations
+    async def replay_deletions(self) -> None:
+        queued = await self._db.run(
+            lambda connection: connection.execute("SELECT id, telegram_id, building FROM deletions ORDER BY id").fetchall()
+        )
+        for row_id, telegram_id, building in queued:
+            try:
+                await database.delete_user_flats(telegram_id, building)
+            except database.DatabaseUnavailable:
+                raise
+            except Exception as err:
+                logging.error("Outbox: dropped queued deletion for user %s (%s): %s", telegram_id, building, err)
+            await self._db.run(lambda connection: connection.execute("DELETE FROM deletions WHERE id = ?", (row_id,)))
+            self.deleted += 1
+
+    # reevaluate(chat_id, user_id, user_name, building) decides a parked request; it stays parked if that raises
+    async def reevaluate_join_requests(self, reevaluate) -> None:
+        parked = await self._db.run(
+            lambda connection: connection.execute(
+                "SELECT chat_id, user_id, user_name, building FROM join_requests ORDER BY parked_at"
+            ).fetchall()
+        )
+        for chat_id, user_id, user_name, building in parked:
+            await reevaluate(chat_id, user_id, user_name, building)
+            await self._db.run(
+                lambda connection: connection.execute(
+                    "DELETE FROM join_requests WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+                )
+            )
+            self.reevaluated += 1
+
+    async def replay_forever(self, reevaluate) -> None:
+        while True:
+            try:
+                # Deletions first: a registration queued before one was already dropped by forget_user,
+                # so the ones still queued came later and must survive it.
+                # Registrations next, so the parked requests of the same users find their records
+                await self.replay_deletions()
+                await self.replay_registrations()
+                await self.reevaluate_join_requests(reevaluate)
+            except database.DatabaseUnavailable:
+                pass
+            except Exception as err:
+                logging.error("Outbox: replay failed: %s", err)
+            await asyncio.sleep(OUTBOX_RETRY)
+
+    def _counts(self, connection) -> tuple[int, int, int]:
+        return (
+            connection.execute("SELECT COUNT(*) FROM registrations").fetchone()[0],
+            connection.execute("SELECT COUNT(*) FROM deletions").fetchone()[0],
+            connection.execute("SELECT COUNT(*) FROM join_requests").fetchone()[0],
+        )
+
+    async def counts(self) -> tuple[int, int, int]:
+        return await self._db.run(self._counts)
+
+    async def close(self) -> None:
+        await self._db.close()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "parked": self.parked,
+            "deletions_queued": self.deletions_queued,
+            "replayed": self.replayed,
+            "deleted": self.deleted,
+            "reevaluated": self.reevaluated,
+        }
+
+
+outbox = Outbox(OUTBOX_PATH)
@@ -0,0 +1,227 @@
+from aiogram import Bot
+from cache import MISSING
+from sender import TokenBucket
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import time
+import database
+import fanout
+import logs
+import membership
+import registry
+
+# How often the whole users table is checked against the chats; 0 turns the job off
+RECONCILE_INTERVAL_HOURS_RAW = os.environ.get("RECONCILE_INTERVAL_HOURS", "24").strip()
+try:
+    RECONCILE_INTERVAL: float = max(0.0, float(RECONCILE_INTERVAL_HOURS_RAW)) * 3600
+except Exception:
+    logging.error("RECONCILE_INTERVAL_HOURS must be a number of hours (e.g., 24), 0 to disable")
+    RECONCILE_INTERVAL = 24 * 3600
+
+# A fresh registration is left alone while its invite link may still be unused
+RECONCILE_GRACE_HOURS_RAW = os.environ.get("RECONCILE_GRACE_HOURS", "168").strip()
+try:
+    RECONCILE_GRACE: float = max(0.0, float(RECONCILE_GRACE_HOURS_RAW)) * 3600
+except Exception:
+    logging.error("RECONCILE_GRACE_HOURS must be a number of hours (e.g., 168)")
+    RECONCILE_GRACE = 168 * 3600
+
+# getChatMember calls the job may make; it shares the Bot API with the handlers, so keep it modest
+RECONCILE_CHECKS_PER_SECOND_RAW = os.environ.get("RECONCILE_CHECKS_PER_SECOND", "5").strip()
+try:
+    RECONCILE_CHECKS_PER_SECOND: float = max(0.1, float(RECONCILE_CHECKS_PER_SECOND_RAW))
+except Exception:
+    logging.error("RECONCILE_CHECKS_PER_SECOND must be a number (e.g., 5)")
+    RECONCILE_CHECKS_PER_SECOND = 5.0
+
+RECONCILE_PAGE_SIZE_RAW = os.environ.get("RECONCILE_PAGE_SIZE", "200").strip()
+try:
+    RECONCILE_PAGE_SIZE: int = max(1, int(RECONCILE_PAGE_SIZE_RAW))
+except Exception:
+    logging.error("RECONCILE_PAGE_SIZE must be a positive integer (e.g., 200)")
+    RECONCILE_PAGE_SIZE = 200
+
+# Progress is saved after every page, so a restart resumes the pass instead of starting over.
+# Only the process holding the lock next to it runs the job; the others check back every minute
+# and take over if that process exits. The lock is per host: on several hosts, enable the job on one
+RECONCILE_CHECKPOINT = os.environ.get("RECONCILE_CHECKPOINT", "reconcile.json").strip()
+RECONCILE_LOCK_RETRY = 60.0
+
+# Only these statuses mean the user is gone; restricted members still count as members
+ABSENT_STATUSES = ["left", "kicked"]
+
+
+# Walks the users table and removes the rows of users who left every connected chat while the bot missed it
+class MembershipReconciler:
+    def __init__(self, interval: float, grace: float, checks_per_second: float, page_size: int, checkpoint_path: str):
+        self.interval = interval
+        self.grace = grace
+        self.page_size = page_size
+        self.checkpoint_path = checkpoint_path
+        self._bucket = TokenBucket(checks_per_second, max(1.0, checks_per_second))
+        self.passes = 0
+        self.checked = 0
+        self.removed = 0
+        self.unknown = 0
+        self.last_id: int | None = None
+        self._lock_file = None
+
+    # Held until the process exits, when the system releases it
+    def _acquire_lock(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(f"{self.checkpoint_path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _load_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+        except Exception as err:
+            logging.error("Reconciler: unreadable checkpoint %s, starting a new pass: %s", self.checkpoint_path, err)
+            return {}
+
+    def _save_checkpoint(self, checkpoint: dict) -> None:
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def _past_grace(self, row: dict, now: float) -> bool:
+        joined_at = row.get("joined_at")
+        # Rows from before joined_at was recorded are old by definition
+        if not joined_at:
+            return True
+        try:
+            return datetime.datetime.fromisoformat(joined_at).timestamp() <= now - self.grace
+        except ValueError:
+            return False
+
+    # None when Telegram could not tell: such a row is kept until the next pass
+    async def _status(self, bot: Bot, check: tuple[int, int]) -> str | None:
+        chat_id, user_id = check
+        if membership.index.lookup(chat_id, user_id) is MISSING:
+            while (wait := self._bucket.delay(time.monotonic())) > 0:
+                await asyncio.sleep(wait)
+            self._bucket.take(time.monotonic())
+        try:
+            return await membership.index.get_status(bot, chat_id, user_id)
+        except Exception as err:
+            logging.info(
+                "Reconciler: membership check failed for user %s in chat %s: %s", user_id, chat_id, err,
+                extra=logs.SAMPLED
+            )
+            return None
+
+    # Same rule as the chat_member handler: data is kept while its owner is in at least one connected chat.
+    # A user missing from one building's chat only may never have joined it, so that alone removes nothing
+    async def _stale_rows(self, bot: Bot, rows: list[dict]) -> list[dict]:
+        chats = registry.current
+        if not chats.connected_chat_ids:
+            return []
+        now = time.time()
+        candidates: dict[int, list[dict]] = {}
+        for row in rows:
+            if self._past_grace(row, now):
+                candidates.setdefault(row["telegram_id"], []).append(row)
+
+        # Like the chat_member handler: the first chat the user is still in settles it, so the chats of
+        # the user's own buildings go first and one at a time; most users cost a single check
+        async def is_gone(user_rows: list[dict]) -> bool:
+            user_id = user_rows[0]["telegram_id"]
+            building_chat_ids = [chats.group_chat_ids.get(row["building"]) for row in user_rows]
+            chat_ids = list(dict.fromkeys(
+                [chat_id for chat_id in building_chat_ids if chat_id is not None] + list(chats.connected_chat_ids)
+            ))
+            unknown = False
+
+            async def still_there(chat_id: int) -> bool:
+                nonlocal unknown
+                status = await self._status(bot, (chat_id, user_id))
+                if status is None:
+                    unknown = True
+                return status not in ABSENT_STATUSES
+
+            if await fanout.find_first(chat_ids, still_there, limit=1) is not None:
+                if unknown:
+                    self.unknown += len(user_rows)
+                return False
+            return True
+
+        users = list(candidates.values())
+        gone = await fanout.gather_limited(users, is_gone)
+        return [row for user_rows, is_stale in zip(users, gone) if is_stale for row in user_rows]
+
+    async def run_pass(self, bot: Bot, checkpoint: dict) -> dict:
+        checked = checkpoint.get("checked", 0)
+        removed = checkpoint.get("removed", 0)
+        async for rows in database.iter_registrations(page_size=self.page_size, after_id=checkpoint.get("last_id")):
+            stale = await self._stale_rows(bot, rows)
+            removed_now = await database.delete_registrations(stale)
+            if stale:
+                logging.info(
+                    "Reconciler: removed %s row(s) of users who left their chats: %s",
+                    removed_now, sorted({row["telegram_id"] for row in stale})
+                )
+            checked += len(rows)
+            removed += removed_now
+            self.checked += len(rows)
+            self.removed += removed_now
+            self.last_id = rows[-1]["id"]
+            checkpoint = {**checkpoint, "last_id": self.last_id, "checked": checked, "removed": removed}
+            self._save_checkpoint(checkpoint)
+
+        self.passes += 1
+        self.last_id = None
+        logging.info("Reconciler: pass finished, %s row(s) checked, %s removed", checked, removed)
+        checkpoint = {"finished_at": time.time(), "checked": checked, "removed": removed}
+        self._save_checkpoint(checkpoint)
+        return checkpoint
+
+    async def run_forever(self, bot: Bot) -> None:
+        if not self.interval:
+            return
+        while not self._acquire_lock():
+            await asyncio.sleep(RECONCILE_LOCK_RETRY)
+        checkpoint = self._load_checkpoint()
+        while True:
+            # A pass in progress resumes at once; a finished one waits out the interval, restarts included
+            if "last_id" not in checkpoint:
+                finished_at = checkpoint.get("finished_at", 0)
+                await asyncio.sleep(max(0.0, finished_at + self.interval - time.time()))
+                checkpoint = {"started_at": time.time(), "last_id": None}
+            try:
+                checkpoint = await self.run_pass(bot, checkpoint)
+            except Exception as err:
+                logging.error("Reconciler: pass interrupted, resuming from the checkpoint: %s", err)
+                checkpoint = self._load_checkpoint()
+                await asyncio.sleep(60)
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "checked": self.checked,
+            "removed": self.removed,
+            "unknown": self.unknown,
+        }
+
+
+reconciler = MembershipReconciler(
+    RECONCILE_INTERVAL,
+    RECONCILE_GRACE,
+    RECONCILE_CHECKS_PER_SECOND,
+    RECONCILE_PAGE_SIZE,
+    RECONCILE_CHECKPOINT
+)
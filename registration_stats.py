@@ -0,0 +1,114 @@
+from singleflight import SingleFlight
+from zoneinfo import ZoneInfo
+import asyncio
+import datetime
+import logging
+import os
+import time
+import database
+
+# /stats answers from the last aggregates for this long; an older snapshot is still shown at once
+# while a fresh one is fetched in the background for the next caller
+STATS_CACHE_RAW = os.environ.get("STATS_CACHE_SECONDS", "120").strip()
+try:
+    STATS_CACHE: float = max(0.0, float(STATS_CACHE_RAW))
+except Exception:
+    logging.error("STATS_CACHE_SECONDS must be a number of seconds (e.g., 120)")
+    STATS_CACHE = 120.0
+
+# Days of per-day registration counts shown by /stats
+STATS_DAYS_RAW = os.environ.get("STATS_DAYS", "14").strip()
+try:
+    STATS_DAYS: int = min(366, max(1, int(STATS_DAYS_RAW)))
+except Exception:
+    logging.error("STATS_DAYS must be a positive integer (e.g., 14)")
+    STATS_DAYS = 14
+
+# Registrations are counted per calendar day in this time zone (an IANA name, e.g. Europe/Moscow)
+STATS_TIMEZONE = os.environ.get("STATS_TIMEZONE", "UTC").strip() or "UTC"
+try:
+    ZoneInfo(STATS_TIMEZONE)
+except Exception:
+    logging.error("STATS_TIMEZONE must be a time zone name (e.g., Europe/Moscow)")
+    STATS_TIMEZONE = "UTC"
+
+# Background refreshes in progress; the event loop only keeps weak references to tasks
+_refreshes: set[asyncio.Task] = set()
+
+
+class Snapshot:
+    def __init__(self, buildings: list[dict], daily: list[dict]):
+        self.buildings = buildings
+        self.daily = daily
+        self.fetched_at = time.time()
+        self.fetched_monotonic = time.monotonic()
+
+
+class RegistrationStats:
+    def __init__(self, ttl: float, days: int, timezone: str):
+        self.ttl = ttl
+        self.days = days
+        self.timezone = timezone
+        self.zone = ZoneInfo(timezone)
+        self.snapshot: Snapshot | None = None
+        self._flights = SingleFlight()
+        self.refreshes = 0
+        self.errors = 0
+
+    async def _fetch(self) -> Snapshot:
+        buildings, daily = await asyncio.gather(
+            database.fetch_building_stats(),
+            database.fetch_daily_registrations(self.days, self.timezone)
+        )
+        self.snapshot = Snapshot(buildings, daily)
+        self.refreshes += 1
+        return self.snapshot
+
+    async def _refresh_quietly(self) -> None:
+        try:
+            await self._flights.do("snapshot", self._fetch)
+        except Exception as err:
+            self.errors += 1
+            logging.error("Stats: background refresh failed, the previous snapshot stays: %s", err)
+
+    # Waits for the database only when there is nothing to show yet
+    async def get(self) -> Snapshot:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return await self._flights.do("snapshot", self._fetch)
+        if time.monotonic() - snapshot.fetched_monotonic >= self.ttl:
+            task = asyncio.create_task(self._refresh_quietly())
+            _refreshes.add(task)
+            task.add_done_callback(_refreshes.discard)
+        return snapshot
+
+    def fetched_at(self, snapshot: Snapshot) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(snapshot.fetched_at, self.zone)
+
+    # Counts for one building, or None for the whole complex
+    @staticmethod
+    def building_row(snapshot: Snapshot, building: str | None) -> dict:
+        for row in snapshot.buildings:
+            if row.get("building") == building:
+                return row
+        return {"building": building, "flats": 0, "residents": 0, "registrations": 0}
+
+    # Every day of the period, newest first, days without registrations included
+    def daily_counts(self, snapshot: Snapshot, building: str | None) -> list[tuple[datetime.date, int]]:
+        counts: dict[str, int] = {}
+        for row in snapshot.daily:
+            if building is None or row.get("building") == building:
+                counts[row["day"]] = counts.get(row["day"], 0) + row["registrations"]
+        today = self.fetched_at(snapshot).date()
+        days = [today - datetime.timedelta(days=offset) for offset in range(self.days)]
+        return [(day, counts.get(day.isoformat(), 0)) for day in days]
+
+    def stats(self) -> dict:
+        return {
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "age_seconds": round(time.time() - self.snapshot.fetched_at, 1) if self.snapshot is not None else -1,
+        }
+
+
+cache = RegistrationStats(STATS_CACHE, STATS_DAYS, STATS_TIMEZONE)
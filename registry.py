@@ -0,0 +1,194 @@
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from dataclasses import dataclass
+from types import MappingProxyType
+import ast
+import asyncio
+import json
+import logging
+import os
+import signal
+
+# Optional JSON file with the same settings as the env variables; its keys take precedence:
+# {"group_chat_ids": {"2": -1001234567890}, "council_chat_ids": {}, "public_chat_id": -1003456789012,
+#  "buildings": ["2", "2к1", "2к4"]}
+# The file is re-read when it changes or on SIGHUP, without a restart
+CONFIG_FILE = os.environ.get("CONFIG_FILE", "").strip()
+CONFIG_CHECK_INTERVAL = 10.0
+
+
+# Chat configuration, built once and never changed: a reload swaps in a whole new registry
+@dataclass(frozen=True)
+class ChatRegistry:
+    buildings: tuple[str, ...]
+    group_chat_ids: MappingProxyType
+    council_chat_ids: MappingProxyType
+    public_chat_id: int | None
+    chat_buildings: MappingProxyType
+    connected_chat_ids: tuple[int, ...]
+    connected: frozenset[int]
+    building_keyboard: InlineKeyboardMarkup
+
+
+def parse_chat_mapping(raw, name: str) -> dict[str, int]:
+    # Example formats:
+    # JSON: {"2": -1001234567890, "2к1": -1002345678901}
+    # Python dict: {'2': -1001234567890, '2к1': -1002345678901}
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except Exception:
+            try:
+                raw = ast.literal_eval(raw)
+            except Exception:
+                raise ValueError(f"Failed to parse {name}. Provide JSON or Python dict mapping of building->chat_id")
+    try:
+        return {str(k): int(v) for k, v in dict(raw).items()}
+    except Exception:
+        raise ValueError(f"{name} contains non-numeric chat ids; please use integers (e.g., -1001234567890)")
+
+
+def parse_chat_id(raw, name: str) -> int | None:
+    if raw is None or str(raw).strip() == "":
+        return None
+    try:
+        return int(str(raw).strip())
+    except Exception:
+        raise ValueError(f"{name} must be an integer chat id (e.g., -1001234567890)")
+
+
+def parse_buildings(raw) -> list[str]:
+    # Example format: 2,2к1,2к4,2к5
+    parts = raw.split(",") if isinstance(raw, str) else list(raw)
+    return [str(part).strip() for part in parts if str(part).strip()]
+
+
+def build_registry(
+    group_chat_ids: dict[str, int],
+    council_chat_ids: dict[str, int],
+    public_chat_id: int | None,
+    buildings: list[str]
+) -> ChatRegistry:
+    # Every building of the complex, including those without their own chat yet:
+    # their residents still register and get access to the shared chat
+    all_buildings = tuple(dict.fromkeys(buildings + list(group_chat_ids)))
+
+    chat_ids = list(group_chat_ids.values())
+    if public_chat_id is not None:
+        chat_ids.append(public_chat_id)
+    connected_chat_ids = tuple(dict.fromkeys(chat_ids))
+
+    keyboard = InlineKeyboardBuilder()
+    for building_name in all_buildings:
+        keyboard.button(
+            text=building_name,
+            callback_data=f"building_{building_name}"
+        )
+    keyboard.adjust(4)
+
+    return ChatRegistry(
+        buildings=all_buildings,
+        group_chat_ids=MappingProxyType(dict(group_chat_ids)),
+        council_chat_ids=MappingProxyType(dict(council_chat_ids)),
+        public_chat_id=public_chat_id,
+        chat_buildings=MappingProxyType({chat_id: building for building, chat_id in group_chat_ids.items()}),
+        connected_chat_ids=connected_chat_ids,
+        connected=frozenset(connected_chat_ids),
+        building_keyboard=keyboard.as_markup()
+    )
+
+
+def load_from_env() -> ChatRegistry:
+    try:
+        group_chat_ids = parse_chat_mapping(os.environ.get("GROUP_CHAT_IDS", "{}"), "GROUP_CHAT_IDS")
+    except ValueError as err:
+        logging.error("%s", err)
+        group_chat_ids = {}
+
+    # Building council chats: receive detailed join notifications. Same format as GROUP_CHAT_IDS
+    try:
+        council_chat_ids = parse_chat_mapping(os.environ.get("COUNCIL_CHAT_IDS", "{}"), "COUNCIL_CHAT_IDS")
+    except ValueError as err:
+        logging.error("%s", err)
+        council_chat_ids = {}
+
+    # Shared chat for the whole complex, offered on top of the building chat
+    try:
+        public_chat_id = parse_chat_id(os.environ.get("PUBLIC_CHAT_ID", ""), "PUBLIC_CHAT_ID")
+    except ValueError as err:
+        logging.error("%s", err)
+        public_chat_id = None
+
+    buildings = parse_buildings(os.environ.get("BUILDINGS", ""))
+    return build_registry(group_chat_ids, council_chat_ids, public_chat_id, buildings)
+
+
+# Raises on a broken file: a reload must never replace a working registry with an empty one
+def load_from_file(path: str, base: ChatRegistry) -> ChatRegistry:
+    with open(path, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+    return build_registry(
+        parse_chat_mapping(config.get("group_chat_ids", dict(base.group_chat_ids)), "group_chat_ids"),
+        parse_chat_mapping(config.get("council_chat_ids", dict(base.council_chat_ids)), "council_chat_ids"),
+        parse_chat_id(config.get("public_chat_id", base.public_chat_id), "public_chat_id"),
+        parse_buildings(config.get("buildings", list(base.buildings)))
+    )
+
+
+env_registry = load_from_env()
+current: ChatRegistry = env_registry
+if CONFIG_FILE:
+    try:
+        current = load_from_file(CONFIG_FILE, env_registry)
+    except Exception as err:
+        logging.error("Failed to load %s, using the env variables: %s", CONFIG_FILE, err)
+_reload_callbacks = []
+
+
+def on_reload(callback) -> None:
+    _reload_callbacks.append(callback)
+
+
+def reload() -> bool:
+    global current
+    if not CONFIG_FILE:
+        return False
+    try:
+        updated = load_from_file(CONFIG_FILE, env_registry)
+    except Exception as err:
+        logging.error("Failed to reload %s, keeping the current configuration: %s", CONFIG_FILE, err)
+        return False
+    previous, current = current, updated
+    logging.info(
+        "Configuration reloaded: buildings=%s, building chats=%s, council chats=%s, public chat=%s",
+        list(updated.buildings), dict(updated.group_chat_ids), dict(updated.council_chat_ids), updated.public_chat_id
+    )
+    for callback in _reload_callbacks:
+        try:
+            callback(previous, updated)
+        except Exception as err:
+            logging.error("Error applying reloaded configuration: %s", err)
+    return True
+
+
+def _mtime() -> float | None:
+    try:
+        return os.stat(CONFIG_FILE).st_mtime
+    except OSError:
+        return None
+
+
+async def watch_forever() -> None:
+    if not CONFIG_FILE:
+        return
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload)
+    except (NotImplementedError, AttributeError):
+        pass
+    last_mtime = _mtime()
+    while True:
+        await asyncio.sleep(CONFIG_CHECK_INTERVAL)
+        mtime = _mtime()
+        if mtime is not None and mtime != last_mtime:
+            last_mtime = mtime
+            reload()
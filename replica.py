@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+# In-process copy of the users table for admin search (/who, /flats). Reads never leave the process,
+# so they keep working while Supabase is down; the data may lag behind by up to one sync interval
+REPLICA_SYNC_RAW = os.environ.get("REPLICA_SYNC_SECONDS", "300").strip()
+try:
+    REPLICA_SYNC: float = max(1.0, float(REPLICA_SYNC_RAW))
+except Exception:
+    logging.error("REPLICA_SYNC_SECONDS must be a number of seconds (e.g., 300)")
+    REPLICA_SYNC = 300.0
+
+# Incremental syncs only see new rows; a full reload also drops rows deleted outside this bot
+REPLICA_FULL_SYNC_HOURS_RAW = os.environ.get("REPLICA_FULL_SYNC_HOURS", "6").strip()
+try:
+    REPLICA_FULL_SYNC: float = max(0.1, float(REPLICA_FULL_SYNC_HOURS_RAW)) * 3600
+except Exception:
+    logging.error("REPLICA_FULL_SYNC_HOURS must be a number of hours (e.g., 6)")
+    REPLICA_FULL_SYNC = 6 * 3600
+
+COLUMNS = ("id", "building", "flat_number", "telegram_id", "username", "first_name", "last_name", "joined_at")
+
+
+def flat_sort_key(flat_number) -> int | None:
+    text = str(flat_number or "").strip()
+    return int(text) if text.isdigit() else None
+
+
+def name_keys(row: dict) -> tuple[str, str, str]:
+    first_name = (row.get("first_name") or "").strip()
+    last_name = (row.get("last_name") or "").strip()
+    return (
+        (row.get("username") or "").lower(),
+        f"{first_name} {last_name}".strip().lower(),
+        f"{last_name} {first_name}".strip().lower(),
+    )
+
+
+def prefix_range(prefix: str) -> tuple[str, str]:
+    return prefix, prefix + "\U0010ffff"
+
+
+# The database lives in memory and is small, so queries run right on the event loop:
+# an indexed lookup takes microseconds, less than handing it to a thread would
+class UsersReplica:
+    def __init__(self, sync_interval: float, full_sync_interval: float):
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self._connection = self._create()
+        # Writes made while a full reload is running, applied to the new copy before it replaces the old one
+        self._journal: list | None = None
+        self.loaded = False
+        self.last_id = 0
+        self.synced_at: float | None = None
+        self.syncs = 0
+        self.sync_errors = 0
+
+    @staticmethod
+    def _create() -> sqlite3.Connection:
+        connection = sqlite3.connect(":memory:", isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute(
+            "CREATE TABLE users ("
+            "id INTEGER PRIMARY KEY, building TEXT, flat_number TEXT, flat_sort INTEGER, telegram_id INTEGER, "
+            "username TEXT, first_name TEXT, last_name TEXT, joined_at TEXT, "
+            "username_key TEXT, name_key TEXT, reversed_name_key TEXT)"
+        )
+        connection.execute("CREATE INDEX users_telegram_id ON users (telegram_id)")
+        connection.execute("CREATE INDEX users_building_flat ON users (building, flat_sort, flat_number)")
+        connection.execute("CREATE INDEX users_flat ON users (flat_sort, flat_number)")
+        connection.execute("CREATE INDEX users_username_key ON users (username_key)")
+        connection.execute("CREATE INDEX users_name_key ON users (name_key)")
+        connection.execute("CREATE INDEX users_reversed_name_key ON users (reversed_name_key)")
+        return connection
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, rows: list[dict]) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    row["id"], row.get("building"), str(row.get("flat_number") or ""),
+                    flat_sort_key(row.get("flat_number")), row.get("telegram_id"), row.get("username"),
+                    row.get("first_name"), row.get("last_name"), row.get("joined_at"), *name_keys(row),
+                )
+                for row in rows
+            ]
+        )
+
+    @staticmethod
+    def _delete_user(connection: sqlite3.Connection, telegram_id: int, building: str | None) -> None:
+        if building is None:
+            connection.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+        else:
+            connection.execute("DELETE FROM users WHERE telegram_id = ? AND building = ?", (telegram_id, building))
+
+    @staticmethod
+    def _delete_ids(connection: sqlite3.Connection, ids: list[int]) -> None:
+        connection.executemany("DELETE FROM users WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def _apply(self, change, *args) -> None:
+        change(self._connection, *args)
+        if self._journal is not None:
+            self._journal.append((change, args))
+
+    # Called by database.py after its own writes went through, so searches see them at once
+    def add(self, rows: list[dict]) -> None:
+        rows = [row for row in rows if row.get("id") is not None]
+        if rows:
+            self._apply(self._insert, rows)
+            self.last_id = max(self.last_id, *(row["id"] for row in rows))
+
+    def delete_user(self, telegram_id: int, building: str | None = None) -> None:
+        self._apply(self._delete_user, telegram_id, building)
+
+    def delete_ids(self, ids: list[int]) -> None:
+        self._apply(self._delete_ids, ids)
+
+    # pages: an async iterator of row lists, like database.iter_registrations
+    async def reload(self, pages) -> None:
+        connection = self._create()
+        self._journal = []
+        last_id = 0
+        try:
+            async for rows in pages:
+                self._insert(connection, rows)
+                last_id = max(last_id, rows[-1]["id"])
+            for change, args in self._journal:
+                change(connection, *args)
+        finally:
+            self._journal = None
+        old_connection, self._connection = self._connection, connection
+        old_connection.close()
+        self.last_id = max(last_id, self.last_id)
+        self.loaded = True
+
+    async def catch_up(self, pages) -> None:
+        async for rows in pages:
+            self.add(rows)
+
+    # iter_pages(after_id) pages through the users table after that id (database.iter_registrations);
+    # passed in so that this module stays free of Supabase
+    async def sync_forever(self, iter_pages) -> None:
+        full_sync_at = 0.0
+        while True:
+            started_at = time.monotonic()
+            try:
+                if started_at >= full_sync_at:
+                    await self.reload(iter_pages(None))
+                    full_sync_at = started_at + self.full_sync_interval
+                    logging.info(
+                        "Replica: loaded %s row(s) in %.0f ms", self.count(), (time.monotonic() - started_at) * 1000
+                    )
+                else:
+                    await self.catch_up(iter_pages(self.last_id))
+                self.synced_at = time.time()
+                self.syncs += 1
+            except Exception as err:
+                self.sync_errors += 1
+                logging.error("Replica: sync failed, searches keep the previous data: %s", err)
+            await asyncio.sleep(self.sync_interval if self.loaded else min(self.sync_interval, 30))
+
+    def count(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # Users by Telegram ID, @username or name; a name or username matches by its beginning
+    def find_users(self, query: str, building: str | None = None, limit: int = 50) -> list[dict]:
+        query = query.strip()
+        if query.lstrip("-").isdigit():
+            sql, params = "telegram_id = ?", [int(query)]
+        elif query.startswith("@"):
+            sql, params = "username_key >= ? AND username_key < ?", [*prefix_range(query[1:].lower())]
+        else:
+            low, high = prefix_range(query.lower())
+            sql = (
+                "id IN (SELECT id FROM users WHERE username_key >= ? AND username_key < ? "
+                "UNION SELECT id FROM users WHERE name_key >= ? AND name_key < ? "
+                "UNION SELECT id FROM users WHERE reversed_name_key >= ? AND reversed_name_key < ?)"
+            )
+            params = [low, high, low, high, low, high]
+        if building is not None:
+            sql += " AND building = ?"
+            params.append(building)
+        rows = self._connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM users WHERE {sql} ORDER BY telegram_id, building, flat_sort, flat_number "
+            "LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # Registrations with flat numbers from first to last, inclusive
+    def find_flats(self, first: int, last: int, building: str | None = None, limit: int = 200) -> list[dict]:
+        sql, params = "flat_sort BETWEEN ? AND ?", [first, last]
+        if building is not None:
+            sql += " AND building = ?"
+            params.append(building)
+        rows = self._connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM users WHERE {sql} ORDER BY building, flat_sort, flat_number, id LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> dict:
+        return {
+            "loaded": int(self.loaded),
+            "rows": self.count(),
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "age_seconds": round(time.time() - self.synced_at, 1) if self.synced_at is not None else -1,
+        }
+
+
+replica = UsersReplica(REPLICA_SYNC, REPLICA_FULL_SYNC)
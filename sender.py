@@ -0,0 +1,239 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+# Telegram limits: about 30 messages per second overall, 20 per minute in a group, 1 per second in a private chat
+SEND_GLOBAL_PER_SECOND_RAW = os.environ.get("SEND_GLOBAL_PER_SECOND", "25").strip()
+try:
+    SEND_GLOBAL_PER_SECOND: float = float(SEND_GLOBAL_PER_SECOND_RAW)
+except Exception:
+    logging.error("SEND_GLOBAL_PER_SECOND must be a number (e.g., 25)")
+    SEND_GLOBAL_PER_SECOND = 25.0
+
+SEND_GROUP_PER_MINUTE_RAW = os.environ.get("SEND_GROUP_PER_MINUTE", "20").strip()
+try:
+    SEND_GROUP_PER_MINUTE: float = float(SEND_GROUP_PER_MINUTE_RAW)
+except Exception:
+    logging.error("SEND_GROUP_PER_MINUTE must be a number (e.g., 20)")
+    SEND_GROUP_PER_MINUTE = 20.0
+
+SEND_PRIVATE_PER_SECOND_RAW = os.environ.get("SEND_PRIVATE_PER_SECOND", "1").strip()
+try:
+    SEND_PRIVATE_PER_SECOND: float = float(SEND_PRIVATE_PER_SECOND_RAW)
+except Exception:
+    logging.error("SEND_PRIVATE_PER_SECOND must be a number (e.g., 1)")
+    SEND_PRIVATE_PER_SECOND = 1.0
+
+# Attempts after a flood-control error before the send is given up
+SEND_MAX_RETRIES_RAW = os.environ.get("SEND_MAX_RETRIES", "3").strip()
+try:
+    SEND_MAX_RETRIES: int = max(0, int(SEND_MAX_RETRIES_RAW))
+except Exception:
+    logging.error("SEND_MAX_RETRIES must be a non-negative integer (e.g., 3)")
+    SEND_MAX_RETRIES = 3
+
+# Lower value goes first
+URGENT = 0  # replies a user is waiting for: invite links, answers to admins
+NORMAL = 1  # welcome posts, deletion notices
+LOW = 2  # council notices
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    # Seconds until a token is available, 0 when one can be taken right away
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    # Telegram asked to back off: nothing goes out through this bucket until then
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Job:
+    def __init__(self, method: TelegramMethod, chat_id: int | None, priority: int, future: asyncio.Future):
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+# Central outbound queue: every send waits for a token of its chat and of the whole bot, by priority
+class MessageScheduler:
+    def __init__(self):
+        self.global_bucket = TokenBucket(SEND_GLOBAL_PER_SECOND, max(1.0, SEND_GLOBAL_PER_SECOND))
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._queue: list = []
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                self._forget_idle_buckets()
+            if chat_id < 0:
+                bucket = TokenBucket(SEND_GROUP_PER_MINUTE / 60, 3)
+            else:
+                bucket = TokenBucket(SEND_PRIVATE_PER_SECOND, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    # A full, unblocked bucket behaves exactly like a new one
+    def _forget_idle_buckets(self) -> None:
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+
+    def start(self, bot: Bot) -> None:
+        self._runner = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        for _, _, job in self._queue:
+            if not job.future.done():
+                job.future.cancel()
+        self._queue.clear()
+
+    # Queue a Bot API call; await the returned future for its result.
+    # Sends that nobody awaits report failures through on_error
+    def submit(
+        self,
+        method: TelegramMethod,
+        priority: int = NORMAL,
+        chat_limited: bool = True,
+        on_error=None
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if on_error is not None:
+            def report(done: asyncio.Future) -> None:
+                if not done.cancelled() and done.exception() is not None:
+                    on_error(done.exception())
+            future.add_done_callback(report)
+        chat_id = getattr(method, "chat_id", None) if chat_limited else None
+        self._push(Job(method, chat_id if isinstance(chat_id, int) else None, priority, future))
+        return future
+
+    def _push(self, job: Job) -> None:
+        heapq.heappush(self._queue, (job.priority, next(self._order), job))
+        self._wakeup.set()
+
+    # Highest-priority job whose chat may send now, or the time to wait for one
+    def _next_job(self, now: float) -> tuple[Job | None, float]:
+        soonest = None
+        for entry in sorted(self._queue):
+            job = entry[2]
+            wait = self._chat_bucket(job.chat_id).delay(now) if job.chat_id is not None else 0.0
+            if wait == 0:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                return job, 0.0
+            soonest = wait if soonest is None else min(soonest, wait)
+        return None, soonest
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_wait = self.global_bucket.delay(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            job, wait = self._next_job(now)
+            if job is None:
+                # A new, more urgent send for another chat may arrive while waiting
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if job.future.done():
+                continue
+            self.global_bucket.take(now)
+            if job.chat_id is not None:
+                self._chat_bucket(job.chat_id).take(now)
+            task = asyncio.create_task(self._deliver(bot, job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, bot: Bot, job: Job) -> None:
+        try:
+            result = await bot(job.method)
+        except TelegramRetryAfter as err:
+            if job.chat_id is not None:
+                self._chat_bucket(job.chat_id).block(err.retry_after)
+            else:
+                self.global_bucket.block(err.retry_after)
+            if job.attempts < SEND_MAX_RETRIES and not job.future.done():
+                job.attempts += 1
+                self.retried += 1
+                logging.info(
+                    "Flood control on %s to %s, retrying in %ss (attempt %s)",
+                    type(job.method).__name__, job.chat_id, err.retry_after, job.attempts
+                )
+                self._push(job)
+                return
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(err)
+            return
+        except Exception as err:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(err)
+            return
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+scheduler = MessageScheduler()
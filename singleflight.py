@@ -0,0 +1,39 @@
+import asyncio
+
+
+# Concurrent calls for the same key share one pending call instead of each making their own.
+# The shared call runs as its own task: a caller that gives up does not cancel it for the others
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, call):
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = self._flights[key] = asyncio.ensure_future(call())
+            flight.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
+
+    def _finish(self, key, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Every caller may have given up already; the error is theirs to see, not the loop's
+        if not flight.cancelled():
+            flight.exception()
+
+    # Later callers start a fresh call; the pending one still answers those already waiting.
+    # For when the answer it is fetching is known to be out of date
+    def forget(self, key) -> None:
+        self._flights.pop(key, None)
+
+    def forget_if(self, predicate) -> None:
+        for key in [key for key in self._flights if predicate(key)]:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import sqlite3
+
+
+# A SQLite file used from the event loop. One thread owns the connection,
+# so calls never block the event loop and never overlap
+class SQLiteWorker:
+    def __init__(self, path: str, name: str, schema: list[str], synchronous: str = "NORMAL"):
+        self.path = path
+        self.schema = schema
+        self.synchronous = synchronous
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-sqlite")
+        self._connection: sqlite3.Connection | None = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # WAL lets several bot processes read while one of them writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            for statement in self.schema:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    # func(connection, *args) runs on the worker thread
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: func(self.connect(), *args)
+        )
+
+    async def close(self) -> None:
+        def close_connection():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, close_connection)
+        self._executor.shutdown(wait=False)
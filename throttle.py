@@ -0,0 +1,160 @@
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+from cache import TTLCache, MISSING
+import json
+import logging
+import os
+import time
+import logs
+import sender
+
+# Handlers pick their class with flags={"throttle": "<class>"}; the rest fall under "default".
+# Limits are (updates per minute, burst) per user and, where set, per chat. The chat limit only
+# counts updates from senders that pass the chat gate (admins), so others cannot use it up
+THROTTLE_DEFAULTS = {
+    "default": {"user": (30, 10)},
+    # Each step queries the database, the last one also creates invite links
+    "registration": {"user": (10, 4)},
+    # Admin check plus a query per command; a busy chat is limited as a whole too
+    "admin": {"user": (20, 5), "chat": (30, 10)},
+    "export": {"user": (2, 2), "chat": (4, 2)},
+}
+
+# Overrides per class, JSON: {"admin": {"chat": [60, 20]}}; null turns a limit off
+THROTTLE_LIMITS_RAW = os.environ.get("THROTTLE_LIMITS", "").strip()
+THROTTLE_LIMITS = {kind: dict(limits) for kind, limits in THROTTLE_DEFAULTS.items()}
+if THROTTLE_LIMITS_RAW:
+    try:
+        for kind, limits in json.loads(THROTTLE_LIMITS_RAW).items():
+            for scope, limit in limits.items():
+                if scope not in ["user", "chat"]:
+                    raise ValueError(f"unknown scope {scope}")
+                THROTTLE_LIMITS.setdefault(kind, {})[scope] = (float(limit[0]), float(limit[1])) if limit else None
+    except Exception:
+        logging.error('THROTTLE_LIMITS must be JSON like {"admin": {"user": [20, 5], "chat": [30, 10]}}')
+
+# Buckets remembered per class and scope; the least recently used ones go first, and a bucket
+# expires once it would have refilled anyway, so dropping it changes nothing
+THROTTLE_MAX_KEYS_RAW = os.environ.get("THROTTLE_MAX_KEYS", "10000").strip()
+try:
+    THROTTLE_MAX_KEYS: int = max(1, int(THROTTLE_MAX_KEYS_RAW))
+except Exception:
+    logging.error("THROTTLE_MAX_KEYS must be a positive integer (e.g., 10000)")
+    THROTTLE_MAX_KEYS = 10000
+
+THROTTLED_TEXT = "⏳ Слишком много запросов подряд. Подождите немного и попробуйте снова."
+
+
+class Throttle:
+    def __init__(self, limits: dict, max_keys: int):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets: dict[tuple[str, str], TTLCache] = {}
+        # Users already told to slow down: one canned reply per cooldown, not one per update
+        self._warned = TTLCache(max_keys, 60)
+        self.allowed = 0
+        self.rejected: dict[str, int] = {}
+
+    def _bucket(self, kind: str, scope: str, key: int) -> sender.TokenBucket | None:
+        limit = self.limits.get(kind, {}).get(scope)
+        if not limit or not limit[0]:
+            return None
+        per_minute, burst = limit
+        buckets = self._buckets.get((kind, scope))
+        if buckets is None:
+            buckets = self._buckets[(kind, scope)] = TTLCache(self.max_keys, max(1.0, burst) * 60 / per_minute)
+        bucket = buckets.get(key)
+        if bucket is MISSING:
+            bucket = sender.TokenBucket(per_minute / 60, max(1.0, burst))
+        # Stored again on every use, which also moves the expiry forward
+        buckets.set(key, bucket)
+        return bucket
+
+    # Seconds until the user's own limit lets the update through, without using a token: checked
+    # before anything that costs a lookup, so a flood is shed for free
+    def user_delay(self, kind: str, user_id: int | None) -> float:
+        bucket = self._bucket(kind, "user", user_id) if user_id is not None else None
+        wait = bucket.delay(time.monotonic()) if bucket is not None else 0.0
+        if wait:
+            self.rejected[kind] = self.rejected.get(kind, 0) + 1
+        return wait
+
+    # 0 when the update may go through, otherwise seconds until it would
+    def check(self, kind: str, user_id: int | None, chat_id: int | None) -> float:
+        now = time.monotonic()
+        buckets = [
+            bucket for bucket in (
+                self._bucket(kind, "user", user_id) if user_id is not None else None,
+                self._bucket(kind, "chat", chat_id) if chat_id is not None else None,
+            )
+            if bucket is not None
+        ]
+        wait = max((bucket.delay(now) for bucket in buckets), default=0.0)
+        if wait:
+            self.rejected[kind] = self.rejected.get(kind, 0) + 1
+            return wait
+        for bucket in buckets:
+            bucket.take(now)
+        self.allowed += 1
+        return 0.0
+
+    def should_warn(self, kind: str, user_id: int, wait: float) -> bool:
+        if self._warned.get((kind, user_id)) is not MISSING:
+            return False
+        self._warned.set((kind, user_id), True, ttl=max(wait, self._warned.ttl))
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": sum(self.rejected.values()),
+            **{f"rejected_{kind}": count for kind, count in self.rejected.items()},
+            "keys": sum(len(buckets) for buckets in self._buckets.values()),
+        }
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    # chat_gate(event) -> bool decides whether an update counts against its chat's limit
+    def __init__(self, throttle: Throttle, chat_gate=None):
+        self.throttle = throttle
+        self.chat_gate = chat_gate
+
+    async def __call__(self, handler, event, data):
+        kind = get_flag(data, "throttle", default="default")
+        chat = data.get("event_chat")
+        # Anonymous admins all share one bot account; the chat they post as tells them apart
+        sender_chat = getattr(event, "sender_chat", None)
+        user = data.get("event_from_user")
+        user_id = sender_chat.id if sender_chat is not None else user.id if user is not None else None
+        wait = self.throttle.user_delay(kind, user_id)
+        if not wait:
+            chat_id = chat.id if chat is not None else None
+            if chat_id is not None and self.chat_gate is not None and self.throttle.limits.get(kind, {}).get("chat"):
+                if not await self.chat_gate(event):
+                    chat_id = None
+            wait = self.throttle.check(kind, user_id, chat_id)
+        if not wait:
+            return await handler(event, data)
+
+        logging.info("Throttled %s update from %s for %.1f s", kind, user_id, wait, extra=logs.SAMPLED)
+        # The button stops spinning either way; only the first rejection says why
+        warn = user_id is not None and self.throttle.should_warn(kind, user_id, wait)
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLED_TEXT if warn else None)
+        elif isinstance(event, Message) and warn and event.chat.type == "private":
+            try:
+                await sender.scheduler.submit(event.answer(THROTTLED_TEXT), priority=sender.NORMAL)
+            except Exception as err:
+                logging.info("Could not tell user %s about throttling: %s", user_id, err)
+        return None
+
+
+limiter = Throttle(THROTTLE_LIMITS, THROTTLE_MAX_KEYS)
+
+
+# Inner middlewares run after the filters, so only updates that reach a handler use up tokens
+def setup(dp, chat_gate=None) -> None:
+    middleware = ThrottleMiddleware(limiter, chat_gate)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)